@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+
+# -*- coding: utf-8 -*-
+#########################################################
+# SCRIPT : bench.py                                     #
+#          Offline benchmarks of mqtt433MHz with a      #
+#          simulated radio and an in-memory MQTT client #
+#########################################################
+
+####################### IMPORTS #########################
+import sys
+import os
+import io
+import json
+import time
+import signal
+import argparse
+import tempfile
+import threading
+import contextlib
+import importlib.util
+from fakes import fakeRadio, fakeClient
+
+#########################################################
+
+####################### GLOBALS #########################
+SCRIPT       = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opt", "mqtt433MHz", "mqtt433MHz.py")
+SIZES        = "10,100,1000,10000"
+FRAMES       = 20000
+COMMANDS     = 200
+TXRATE       = 200
+STARTTIMEOUT = 60.0
+RUNTIMEOUT   = 300.0
+POLLTIME     = 0.005
+
+#########################################################
+
+def loadModule():
+    spec = importlib.util.spec_from_file_location("mqtt433MHz", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def rfCode(index):
+    # unique sys, group and device code per device
+    return 1 + index // 256, 1 + (index // 16) % 16, index % 16
+
+def makeConfig(path, devices, dedupe = 0.0, discodelay = 0.0):
+    # even devices are inputs (event), odd devices outputs (switch)
+    lines = ['<?xml version="1.0" encoding="utf-8"?>', "<mqtt433MHz>",
+             "\t<broker>localhost</broker>", "\t<port>1883</port>",
+             "\t<dedupe>" + str(dedupe) + "</dedupe>", "\t<discodelay>" + str(discodelay) + "</discodelay>",
+             "\t<devices>"]
+    for index in range(devices):
+        syscode, groupcode, devicecode = rfCode(index)
+        name = "dev" + str(index)
+        rfout = index % 2 == 1
+        lines.append("\t\t<" + name + ">")
+        lines.append("\t\t\t<RFout>" + ("true" if rfout else "false") + "</RFout>")
+        lines.append("\t\t\t<item433><SysCode>" + str(syscode) + "</SysCode><GroupCode>" + str(groupcode) +
+                     "</GroupCode><DeviceCode>" + str(devicecode) + "</DeviceCode></item433>")
+        lines.append("\t\t\t<hadevice><name>" + name + "</name><mf>bench</mf><mdl>bench</mdl></hadevice>")
+        if rfout:
+            lines.append("\t\t\t<itemmqtt><maintopic>bench/" + name + "</maintopic><cmd_t>set</cmd_t><stat_t>state</stat_t></itemmqtt>")
+            lines.append("\t\t\t<hatype>switch</hatype><hadisco><name>" + name + "</name><dev_cla>outlet</dev_cla></hadisco>")
+        else:
+            lines.append("\t\t\t<itemmqtt><maintopic>bench/" + name + "</maintopic><stat_t>event</stat_t></itemmqtt>")
+            lines.append("\t\t\t<hatype>event</hatype><hadisco><name>" + name + "</name><dev_cla>button</dev_cla></hadisco>")
+        lines.append("\t\t</" + name + ">")
+    lines += ["\t</devices>", "</mqtt433MHz>", ""]
+    with open(path, "w") as xml_file:
+        xml_file.write("\n".join(lines))
+
+def makeFrames(module, devices, frames):
+    # frames of the input devices in turn, values alternating
+    app = module.mqtt433MHz.__new__(module.mqtt433MHz)
+    inputs = [rfCode(index) for index in range(0, devices, 2)]
+    return [app.code2array(*(inputs[index % len(inputs)] + ((index // len(inputs)) % 2,))) for index in range(frames)]
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def waitFor(condition, timeout):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise RuntimeError("timeout")
+        time.sleep(POLLTIME)
+
+#########################################################
+# Class : benchmark                                     #
+#########################################################
+class benchmark(object):
+    def __init__(self, module, args):
+        self.module = module
+        self.args   = args
+
+    def newApp(self, radio, xmlpath):
+        module = self.module
+        class benchApp(module.mqtt433MHz):
+            # the daemon with the radio and MQTT client replaced by the fakes
+            def newRadio(self, args = {}):
+                return radio
+
+            def newClient(self, clientId, cleanSession = True):
+                self.fakeClient = fakeClient(clientId, cleanSession)
+                return self.fakeClient
+        app = benchApp()
+        # keep Ctrl-C for the benchmark
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        app.db = module.database(xmlpath, "")
+        return app
+
+    def run(self, devices, workdir):
+        module = self.module
+        args = self.args
+        result = {"devices": devices}
+        xmlpath = os.path.join(workdir, "bench" + str(devices) + ".xml")
+        makeConfig(xmlpath, devices, args.dedupe, args.discodelay)
+
+        ####### Configuration load and compile
+        start = time.perf_counter()
+        db = module.database(xmlpath, "")
+        result["load_ms"] = (time.perf_counter() - start) * 1000
+        cachedir = os.path.join(workdir, "cache" + str(devices))
+        module.database(xmlpath, cachedir)
+        start = time.perf_counter()
+        module.database(xmlpath, cachedir)
+        result["cached_load_ms"] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        module.compiledConfig(db(), "bench")
+        result["compile_ms"] = (time.perf_counter() - start) * 1000
+
+        ####### Daemon startup, includes the startup discovery publish
+        radio = fakeRadio(makeFrames(module, devices, args.frames), args.rate, args.repeat, args.txtime)
+        app = self.newApp(radio, xmlpath)
+        daemon = threading.Thread(target = app.daemon, name = "benchDaemon", daemon = True)
+        start = time.perf_counter()
+        daemon.start()
+        try:
+            waitFor(radio.reading.is_set, STARTTIMEOUT)
+            # the broker connects and publishes discovery in the background
+            waitFor(lambda: "discovery publish" in app.timer.events, STARTTIMEOUT)
+            result["startup_ms"] = (time.perf_counter() - start) * 1000
+
+            ####### HA discovery replay
+            start = time.perf_counter()
+            app.publishDiscos()
+            result["disco_ms"] = (time.perf_counter() - start) * 1000
+            result["discos"] = len(app.config.discos)
+
+            ####### RX throughput
+            total = radio.total()
+            handled = app.metrics.counters["rx_frames"]
+            cpu = time.process_time()
+            start = time.perf_counter()
+            radio.start()
+            waitFor(lambda: app.metrics.counters["rx_frames"] - handled >= total, RUNTIMEOUT)
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            result["frames"] = total
+            result["frames_per_s"] = total / elapsed
+            result["cpu_us_per_frame"] = cpu / total * 1000000
+
+            ####### Command to TX latency
+            outputs = [device for device in app.config.devices if device.rfout]
+            sent = []
+            for index in range(args.commands if outputs else 0):
+                output = outputs[index % len(outputs)]
+                sent.append(time.monotonic())
+                app.fakeClient.deliver(output.topics.cmd, str(index % 2))
+                if args.txrate > 0:
+                    time.sleep(1.0 / args.txrate)
+            waitFor(lambda: len(radio.writes) >= len(sent), RUNTIMEOUT)
+            latencies = [write[0] - received for write, received in zip(radio.writes, sent)]
+            result["commands"] = len(sent)
+            result["tx_p50_ms"] = percentile(latencies, 0.5) * 1000
+            result["tx_p99_ms"] = percentile(latencies, 0.99) * 1000
+        finally:
+            app.exit_app(None, None)
+            daemon.join(STARTTIMEOUT)
+        return result
+
+#########################################################
+
+COLUMNS = (("devices", "devices", "{:d}"),
+           ("load_ms", "load ms", "{:.1f}"),
+           ("cached_load_ms", "cached ms", "{:.1f}"),
+           ("compile_ms", "compile ms", "{:.1f}"),
+           ("startup_ms", "startup ms", "{:.1f}"),
+           ("disco_ms", "disco ms", "{:.1f}"),
+           ("frames_per_s", "frames/s", "{:.0f}"),
+           ("cpu_us_per_frame", "cpu us/frame", "{:.1f}"),
+           ("tx_p50_ms", "tx p50 ms", "{:.2f}"),
+           ("tx_p99_ms", "tx p99 ms", "{:.2f}"))
+
+def printResult(result, header = False):
+    if header:
+        print("  ".join(title.rjust(12) for key, title, fmt in COLUMNS))
+    print("  ".join(fmt.format(result[key]).rjust(12) for key, title, fmt in COLUMNS))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "Offline mqtt433MHz benchmarks, no radio or broker needed")
+    parser.add_argument("--sizes", default = SIZES, help = "comma separated device counts (default " + SIZES + ")")
+    parser.add_argument("--frames", type = int, default = FRAMES, help = "frames per RX run (default " + str(FRAMES) + ")")
+    parser.add_argument("--rate", type = float, default = 0, help = "RX frames per second, 0 is unlimited (default 0)")
+    parser.add_argument("--repeat", type = int, default = 1, help = "times each frame is received (default 1)")
+    parser.add_argument("--dedupe", type = float, default = 0.0, help = "dedupe window in seconds (default 0)")
+    parser.add_argument("--commands", type = int, default = COMMANDS, help = "commands per TX run (default " + str(COMMANDS) + ")")
+    parser.add_argument("--txrate", type = float, default = TXRATE, help = "commands per second, 0 is all at once (default " + str(TXRATE) + ")")
+    parser.add_argument("--txtime", type = float, default = 0.0, help = "seconds a simulated transmission takes (default 0)")
+    parser.add_argument("--discodelay", type = float, default = 0.0, help = "seconds between discovery batches (default 0)")
+    parser.add_argument("--json", help = "also write the results to this file")
+    parser.add_argument("--verbose", action = "store_true", help = "show the daemon's output")
+    args = parser.parse_args(argv[1:])
+
+    module = loadModule()
+    bench = benchmark(module, args)
+    results = []
+    with tempfile.TemporaryDirectory(prefix = "mqtt433bench") as workdir:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            output = io.StringIO()
+            if args.verbose:
+                result = bench.run(size, workdir)
+            else:
+                with contextlib.redirect_stdout(output):
+                    result = bench.run(size, workdir)
+            results.append(result)
+            printResult(result, len(results) == 1)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"version": module.VERSION, "python": sys.version.split()[0], "results": results}, json_file, indent = 2)
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+# -*- coding: utf-8 -*-
+#########################################################
+# SCRIPT : fakes.py                                     #
+#          Stand-ins for the 433MHz transceiver and the #
+#          paho MQTT client, no hardware or broker      #
+#          needed                                       #
+#########################################################
+
+####################### IMPORTS #########################
+import time
+import threading
+from collections import OrderedDict
+
+#########################################################
+
+#########################################################
+# Class : fakeRadio                                     #
+#########################################################
+class fakeRadio(object):
+    # Pi433MHzif look-alike, plays a frame script and records transmissions
+    def __init__(self, frames = [], rate = 0, repeat = 1, txtime = 0.0):
+        self.frames   = frames  # list of arrays as returned by ReadMessage
+        self.rate     = rate    # frames per second, 0 is as fast as they are read
+        self.repeat   = repeat  # each frame is received this many times, like a remote repeating its code
+        self.txtime   = txtime  # seconds a transmission takes
+        self.index    = 0
+        self.started  = None
+        self.reading  = threading.Event() # set on the first read
+        self.finished = threading.Event() # set when the script is played
+        self.writes   = [] # (monotonic time, array)
+        self.lock     = threading.Lock()
+
+    def start(self):
+        self.index = 0
+        self.finished.clear()
+        self.started = time.monotonic()
+
+    def total(self):
+        return len(self.frames) * self.repeat
+
+    def ReadMessage(self, size):
+        self.reading.set()
+        if self.started == None:
+            return 0, []
+        if self.index >= self.total():
+            self.finished.set()
+            return 0, []
+        if self.rate > 0 and time.monotonic() < self.started + self.index / self.rate:
+            return 0, []
+        array = self.frames[self.index // self.repeat]
+        self.index += 1
+        return len(array), list(array)
+
+    def WriteMessage(self, array, size):
+        if self.txtime > 0:
+            time.sleep(self.txtime)
+        with self.lock:
+            self.writes.append((time.monotonic(), array))
+        return size
+
+#########################################################
+
+#########################################################
+# Class : fakeMessageInfo                               #
+#########################################################
+class fakeMessageInfo(object):
+    def __init__(self, mid):
+        self.mid = mid
+        self.rc  = 0
+
+#########################################################
+
+#########################################################
+# Class : fakeMessage                                   #
+#########################################################
+class fakeMessage(object):
+    def __init__(self, topic, payload):
+        self.topic   = topic
+        self.payload = payload
+        self.qos     = 0
+        self.retain  = False
+
+#########################################################
+
+#########################################################
+# Class : fakeClient                                    #
+#########################################################
+class fakeClient(object):
+    # paho client look-alike, records publishes and subscriptions in memory
+    def __init__(self, client_id = "", clean_session = True):
+        self.client_id     = client_id
+        self.clean_session = clean_session
+        self.on_message    = None
+        self.on_connect    = None
+        self.on_disconnect = None
+        self.on_publish    = None
+        self.on_log        = None
+        self.userdata      = None
+        self.lock          = threading.Lock()
+        self.mid           = 0
+        self.published     = 0
+        self.topics        = OrderedDict() # topic --> publish count
+        self.retained      = {}            # topic --> last retained payload
+        self.subscribed    = set()
+
+    def user_data_set(self, userdata):
+        self.userdata = userdata
+
+    def username_pw_set(self, username, password = None):
+        pass
+
+    def reconnect_delay_set(self, min_delay = 1, max_delay = 120):
+        pass
+
+    def connect(self, host, port = 1883, keepalive = 60):
+        if self.on_connect:
+            self.on_connect(self, self.userdata, {}, 0)
+        return 0
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        if self.on_disconnect:
+            self.on_disconnect(self, self.userdata, 0)
+        return 0
+
+    def subscribe(self, topic, qos = 0):
+        with self.lock:
+            if isinstance(topic, list):
+                self.subscribed.update(item[0] for item in topic)
+            else:
+                self.subscribed.add(topic)
+        return 0, 0
+
+    def unsubscribe(self, topic):
+        with self.lock:
+            if isinstance(topic, list):
+                self.subscribed.difference_update(topic)
+            else:
+                self.subscribed.discard(topic)
+        return 0, 0
+
+    def publish(self, topic, payload = None, qos = 0, retain = False):
+        with self.lock:
+            self.mid += 1
+            mid = self.mid
+            self.published += 1
+            self.topics[topic] = self.topics.get(topic, 0) + 1
+            if retain:
+                self.retained[topic] = payload
+        if self.on_publish:
+            self.on_publish(self, self.userdata, mid)
+        return fakeMessageInfo(mid)
+
+    def deliver(self, topic, payload):
+        # a message from the broker, on the caller's thread like paho's network thread
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        if topic in self.subscribed and self.on_message:
+            self.on_message(self, self.userdata, fakeMessage(topic, payload))
+
+#########################################################
@@ -7,6 +7,7 @@ INSTALL_FOLDER="cp -r *"
 ETCDIR="/etc"
 OPTDIR="/opt"
 OPTLOC="$OPTDIR/$NAME"
+CACHELOC="/var/cache/$NAME"
 ETCLOC=$ETCDIR
 SERVICEDIR="$ETCDIR/systemd/system"
 SERVICESCRIPT="$NAME.service"
@@ -31,6 +32,7 @@ then
 
     echo "Uninstalling $NAME"
 	if [ -d "$OPTLOC" ]; then rm -rf "$OPTLOC"; fi
+	if [ -d "$CACHELOC" ]; then rm -rf "$CACHELOC"; fi
 elif [ "$1" == "-h" ] || [ "$1" == "-H" ]
 then
 	echo "Usage:"
@@ -9,38 +9,120 @@
 #########################################################
 
 ####################### IMPORTS #########################
+import time
+IMPORTSTART = time.monotonic()
 import sys
+import io
 import os
 import signal
-import time
 import json
+import marshal
+import struct
+import hashlib
+import stat
+import select
+import threading
+import queue
+import atexit
+import logging
+from collections import deque, OrderedDict
+from types import MappingProxyType
+from bisect import bisect_left
+from importlib.util import find_spec
 import xml.etree.ElementTree as ET
-from xml.dom.minidom import parseString
-from uuid import getnode
+# heavy imports (paho, Pi433MHzif, uuid, logging.handlers, random) are deferred until used
 try:
-    import paho.mqtt.client as mqttclient
-    ifinstalled = True
+    ifinstalled = find_spec("paho.mqtt.client") != None
 except ImportError:
     ifinstalled = False
 try:
-    from Pi433MHzif import Pi433MHzif
-    if433installed = True                     
+    if433installed = find_spec("Pi433MHzif.Pi433MHzif") != None
 except ImportError:
     if433installed = False
+IMPORTEND = time.monotonic()
 
 #########################################################
 
 ####################### GLOBALS #########################
 VERSION      = "0.80"
 XML_FILENAME = "mqtt433MHz.xml"
+CACHEDIR     = "/var/cache/mqtt433MHz"
+CACHEFILE    = "mqtt433MHz.cache"
+CACHEVERSION = 3
 ENCODING     = 'utf-8'
 CONFIG       = "config"
-SLEEPTIME    = 0.1
+RXPOLLTIME   = 0.005 # right after a frame
+RXPOLLMAX    = 0.1   # when idle, no more wakeups than a fixed 0.1 s poll
+RXFDTIMEOUT  = 1.0
+RXSIZE       = 4
+RFVALUES     = (0, 1) # values with pre-encoded payloads and frames, others are encoded per message
+CAPTUREMAGIC = b"M433CAP1"
+CAPTUREHEADER = struct.Struct("<dBB")
+REPLAYSPEED  = 1.0
 QOS          = 0
+SUBQOS       = 1 # for a persistent session, the broker only queues QoS>0 messages
 RETAIN       = True
 RETAINEVENT  = False
 HASTATUS     = "status"
 HAONLINE     = "online"
+HATOPIC      = "homeassistant"
+DEFAULTRADIO = "default"
+DEFAULTBROKER = "broker"
+BROKERKEYS   = ("broker", "port", "username", "password", "qos", "prefix", "persistent", "outboxfile")
+METRICSINTERVAL = 60
+METRICSADDRESS = "127.0.0.1"
+METRICPREFIX = "mqtt433mhz_"
+METRICBUCKETS = (0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+METRICCOUNTERS = OrderedDict([
+    ("rx_frames",           "433MHz frames read"),
+    ("rx_matched",          "433MHz frames matching an input device"),
+    ("rx_unmatched",        "433MHz frames matching no input device"),
+    ("rx_duplicates",       "433MHz frames dropped as duplicate"),
+    ("events_published",    "MQTT events published"),
+    ("commands_received",   "MQTT commands received for an output device"),
+    ("commands_rejected",   "MQTT commands rejected by a full TX queue"),
+    ("tx",                  "433MHz transmissions"),
+    ("tx_errors",           "433MHz transmissions failed"),
+    ("mqtt_connects",       "MQTT broker connections"),
+    ("mqtt_disconnects",    "MQTT broker disconnections")])
+METRICHISTOGRAMS = OrderedDict([
+    ("tx_duration",         "433MHz transmission duration"),
+    ("rx_latency",          "Time from 433MHz frame read to MQTT publish")])
+TRACESIZE = 1024
+TRACEINTERVAL = 60
+TRACEPENDING = 256
+TRACERXSPANS = ("read_lookup", "lookup_publish", "publish_ack", "total")
+TRACETXSPANS = ("queued", "send", "total")
+TRACEPERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+TXQUEUESIZE  = 32
+TXBLOCK      = "block"
+TXDROPOLDEST = "dropoldest"
+TXREJECT     = "reject"
+TXOVERFLOW   = TXDROPOLDEST # never stalls the MQTT loop
+TXBLOCKTIME  = 0.5 # longest block, then the command is rejected
+TXJOINTIME   = 2.0
+TXCOALESCE   = 0.0
+DEDUPE       = 0.0
+DEDUPEMAX    = 1024
+DISCOBATCH   = 20
+DISCODELAY   = 0.05
+WATCHCONFIG  = 0
+LEARNSIZE    = 256
+LEARNRATE    = 10
+RECONNECTDELAY = 1
+RECONNECTMAXDELAY = 60
+OUTBOXSIZE   = 1000
+OUTBOXRATE   = 20
+OUTBOXINFLIGHT = 100
+OUTBOXRETRY  = 1.0
+OUTBOXFILESIZE = 1048576
+OUTBOXMAGIC  = b"M433OBX1"
+SPILLHEADER  = struct.Struct("<8sQQQQ")
+SPILLRECORD  = struct.Struct("<QB?H")
+LOGFORMAT    = "%(message)s"
+LOGRINGFORMAT = "%(asctime)s %(threadName)s %(levelname)s %(message)s"
+LOGRING      = 0
+log          = logging.getLogger("mqtt433MHz")
 #########################################################
 
 ###################### FUNCTIONS ########################
@@ -49,8 +131,12 @@ HAONLINE     = "online"
 # Class : database                                      #
 #########################################################
 class database(object):
-    def __init__(self):
+    def __init__(self, xmlpath = "", cachedir = CACHEDIR):
         self.db = {}
+        self.comment = "" # header comment, written back as is
+        self.skipped = {} # device name --> reason, invalid devices are kept for write back but not compiled
+        self.xmlpath = xmlpath   # default /etc location if empty
+        self.cachedir = cachedir # no cache if empty
         if not self.getXMLpath(False):
             # only create xml if super user, otherwise keep empty
             self.createXML()
@@ -69,9 +155,25 @@ class database(object):
         self.updateXML()
 
     def reload(self):
-        del self.db
-        self.db = {}
-        self.getXML()
+        # keep the current settings if the new file cannot be parsed
+        saved = self.snapshot()
+        if self.getXML(False):
+            return True
+        self.restore(saved)
+        return False
+
+    def snapshot(self):
+        return (self.db, self.comment, self.skipped)
+
+    def restore(self, saved):
+        self.db, self.comment, self.skipped = saved
+
+    def getSetting(self, key, default = None):
+        # top level setting, default if omitted or empty
+        if key in self.db.keys():
+            if self.db[key] != "":
+                return self.db[key]
+        return default
 
     def bl(self, val):
         retval = False
@@ -119,62 +221,155 @@ class database(object):
 
         return retval
 
-    def getXML(self):
-        XMLpath = self.getXMLpath()
+    def getXML(self, doexit = True):
+        XMLpath = self.getXMLpath(doexit)
         try:
-            tree = ET.parse(XMLpath)
-            root = tree.getroot()
-            self.db = self.parseKids(root, True)
+            with open(XMLpath, "rb") as xml_file:
+                content = xml_file.read()
+                st = os.fstat(xml_file.fileno())
+            fingerprint = (st.st_mtime_ns, st.st_size, hashlib.sha1(content).hexdigest())
+            cached = self.readCache(fingerprint)
+            if cached == None:
+                db, comment, skipped = self.parseXML(content)
+                self.writeCache(fingerprint, db, comment, skipped)
+            else:
+                db, comment, skipped = cached
+            for name, reason in skipped.items():
+                log.warning("Device [%s] skipped: %s", name, reason)
+            self.db = db
+            self.comment = comment
+            self.skipped = skipped
         except Exception as e:
-            print("Error parsing xml file")
-            print("Check XML file syntax for errors")
-            print(e)
-            exit(1)
+            log.warning("Error parsing xml file")
+            log.warning("Check XML file syntax for errors")
+            log.info("%s", e)
+            if doexit:
+                exit(1)
+            return False
+        return True
 
-    def parseKids(self, item, isRoot = False):
-        db = {}
-        if self.hasKids(item):
-            for kid in item:
-                if self.hasKids(kid):
-                    db[kid.tag] = self.parseKids(kid)
-                else:
-                    db.update(self.parseKids(kid))
-        elif not isRoot:
-            db[item.tag] = self.gettype(item.text)
-        return db
+    def readCache(self, fingerprint):
+        # parsed settings and comment if the cache belongs to this exact XML file, otherwise None
+        if not self.cachedir:
+            return None
+        try:
+            with open(os.path.join(self.cachedir, CACHEFILE), "rb") as cache_file:
+                version, pyversion, cached, db, comment, skipped = marshal.load(cache_file)
+            if version == CACHEVERSION and pyversion == sys.hexversion and tuple(cached) == fingerprint:
+                return db, comment, skipped
+        except Exception:
+            pass
+        return None
 
-    def hasKids(self, item):
-        retval = False
-        for kid in item:
-            retval = True
-            break
-        return retval
+    def writeCache(self, fingerprint, db, comment, skipped):
+        # best effort, no cache if the location is not writable
+        if not self.cachedir:
+            return
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir, 0o700)
+            cachepath = os.path.join(self.cachedir, CACHEFILE)
+            # the settings hold the broker password, only readable by the owner
+            fd = os.open(cachepath + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "wb") as cache_file:
+                marshal.dump((CACHEVERSION, sys.hexversion, fingerprint, db, comment, skipped), cache_file)
+            os.replace(cachepath + ".tmp", cachepath)
+        except Exception:
+            pass
 
-    def updateXML(self):
-        db = ET.Element('mqtt433MHz')
-        pcomment = self.getXMLcomment("")
-        if pcomment:
-            comment = ET.Comment(pcomment)
-            db.append(comment)
-        self.buildXML(db, self.db)
+    def parseXML(self, content):
+        # streamed, each element is converted when it ends and then dropped, only the open elements are in memory
+        db = {}
+        comment = ""
+        skipped = {}
+        stack = [] # (element, kids) per open element
+        for event, elem in ET.iterparse(io.BytesIO(content), ("start", "end", "comment")):
+            if event == "start":
+                stack.append((elem, {}))
+            elif event == "end":
+                elem, kids = stack.pop()
+                if not stack:
+                    db = kids
+                    break
+                parent, settings = stack[-1]
+                # an element with kids is a section, otherwise a setting
+                settings[elem.tag] = kids if kids else self.gettype(elem.text)
+                if len(stack) == 2 and parent.tag == "devices":
+                    # checked once here, the device itself without references to other settings or devices
+                    try:
+                        compiledConfig.checkDevice(settings[elem.tag])
+                    except ValueError as e:
+                        skipped[elem.tag] = str(e)
+                elem.clear()
+                del parent[-1]
+            elif len(stack) == 1 and not comment:
+                comment = elem.text
+        return db, comment, skipped
 
+    def updateXML(self):
         XMLpath = self.getXMLpath(dowrite = True)
+        self.writeXML(XMLpath, self.comment, self.db)
+
+    def writeXML(self, XMLpath, comment, db):
+        # streamed to a temp file next to the config and renamed over it, a crash leaves either the old or the new file
+        tmppath = XMLpath + ".tmp"
+        try:
+            with open(tmppath, "w", encoding = ENCODING) as xml_file:
+                self.copyOwner(XMLpath, xml_file.fileno())
+                xml_file.write('<?xml version="1.0" encoding="' + ENCODING + '"?>\n<mqtt433MHz>\n')
+                if comment:
+                    xml_file.write("\t<!--" + comment + "-->\n")
+                self.writeKids(xml_file, db, "\t")
+                xml_file.write("</mqtt433MHz>\n")
+                xml_file.flush()
+                os.fsync(xml_file.fileno())
+            os.replace(tmppath, XMLpath)
+        except:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+        # make the rename itself durable
+        dirfd = os.open(os.path.dirname(os.path.abspath(XMLpath)), os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
 
-        with open(XMLpath, "w") as xml_file:
-            xml_file.write(self.prettify(db))
+    @staticmethod
+    def escape(text):
+        # what minidom escapes in text, saxutils would pull in urllib and email
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
 
-    def buildXML(self, xmltree, item):
-        if isinstance(item, dict):
-            for key, value in item.items():
-                kid = ET.SubElement(xmltree, key)
-                self.buildXML(kid, value)
-        else:
-            xmltree.text = self.settype(item)
+    def writeKids(self, xml_file, item, indent):
+        # same layout as minidom's toprettyxml with a tab indent
+        for key, value in item.items():
+            if isinstance(value, dict) and value:
+                xml_file.write(indent + "<" + key + ">\n")
+                self.writeKids(xml_file, value, indent + "\t")
+                xml_file.write(indent + "</" + key + ">\n")
+            else:
+                text = self.settype(value) if not isinstance(value, dict) else ""
+                if text:
+                    xml_file.write(indent + "<" + key + ">" + self.escape(text) + "</" + key + ">\n")
+                else:
+                    xml_file.write(indent + "<" + key + "/>\n")
+
+    def copyOwner(self, XMLpath, fd):
+        # the config may hold the broker password, keep its mode and owner
+        try:
+            st = os.stat(XMLpath)
+        except FileNotFoundError:
+            return
+        os.fchmod(fd, stat.S_IMODE(st.st_mode))
+        try:
+            os.fchown(fd, st.st_uid, st.st_gid)
+        except PermissionError:
+            pass
 
     def createXML(self):
-        print("Creating new XML file")
-        db = ET.Element('mqtt433MHz')
-        comment = ET.Comment("This XML file describes the topics to relay.\n"
+        log.info("Creating new XML file")
+        comment = ("This XML file describes the topics to relay.\n"
         "            Add an item to add a relay.\n"
         "            <mqtt433MHz> Main element, do not change name\n"
         "                <broker> Address of MQTT broker\n"
@@ -182,9 +377,53 @@ class database(object):
         "                <username> MQTT username\n"
         "                <password> MQTT password\n"
         "                <hatopic> home assistant topic (default homeassistant)\n"
+        "                <qos> QoS for publishes and subscriptions (default 0)\n"
+        "                <prefix> prepended to the device topics, not to the HA discovery topics (default none)\n"
+        "                <persistent> keep the MQTT session, the broker queues commands while disconnected (default false)\n"
+        "                <reconnectdelay> seconds before the first retry to connect to the broker (default 1)\n"
+        "                <reconnectmaxdelay> maximum seconds between retries, doubled each retry (default 60)\n"
+        "                <txqueuesize> max pending 433MHz commands (default 32)\n"
+        "                <txoverflow> dropoldest, reject or block when the command queue is full, block stalls the MQTT loop up to 0.5 s, then rejects, in asyncio mode it rejects at once (default dropoldest)\n"
+        "                <txcoalesce> seconds to collapse repeated commands for the same device to the latest (default 0, off)\n"
+        "                <dedupe> seconds to drop repeated identical frames from input devices (default 0, off)\n"
+        "                <rxpoll> maximum seconds between polls of an idle radio, 0.005 after each frame (default 0.1)\n"
+        "                <discobatch> HA discovery messages published per batch (default 20)\n"
+        "                <discodelay> seconds between HA discovery batches (default 0.05)\n"
+        "                <watchconfig> seconds between checks for changes of this file, reload if changed (default 0, off, use SIGHUP)\n"
+        "                <metricstopic> publish metrics as retained JSON on this topic (default off)\n"
+        "                <metricsinterval> seconds between metrics publishes (default 60)\n"
+        "                <metricsport> serve Prometheus metrics on this local port (default off)\n"
+        "                <metricsaddress> address for the Prometheus metrics port (default 127.0.0.1)\n"
+        "                <trace> trace RX and TX latency, percentiles printed on SIGUSR1 (default false)\n"
+        "                <tracesize> number of events kept for percentiles (default 1024)\n"
+        "                <traceslo> report events slower than this in ms (default 0 = off)\n"
+        "                <tracetopic> publish percentiles on this topic (default off)\n"
+        "                <traceinterval> seconds between percentile publishes (default 60)\n"
+        "                <outboxsize> events and states kept while the broker is unavailable (default 1000, 0 = off)\n"
+        "                <outboxlatest> keep only the latest message per device in the outbox (default false)\n"
+        "                <outboxrate> messages per second sent from the outbox after reconnect (default 20, 0 = no limit)\n"
+        "                <outboxinflight> use the outbox when more messages wait for the broker (default 100, 0 = off)\n"
+        "                <outboxfile> memory mapped file for messages that don't fit in the outbox (default off)\n"
+        "                <outboxfilesize> size of the outbox file in bytes (default 1048576)\n"
+        "                <learntopic> announce unknown 433MHz codes on this topic (default off)\n"
+        "                <learnsize> number of unknown codes remembered (default 256)\n"
+        "                <learnrate> maximum announcements per minute (default 10)\n"
+        "                <learnsnippet> add an XML device snippet to the announcement (default false)\n"
+        "                <logring> keep the last records, including debug records, dumped on SIGUSR2 (default 0 = off)\n"
+        "                <brokers> optional, the settings above are the only broker if omitted\n"
+        "                    <broker1> broker name is key, publish to all brokers, commands from every broker, the first broker is traced\n"
+        "                        <broker>, <port>, <username>, <password>, <qos>, <prefix> as above, per broker\n"
+        "                        <persistent> overrides the global persistent\n"
+        "                        <outboxfile> outbox file for this broker (default off, the global outboxfile for the first broker)\n"
+        "                <radios> optional, one transceiver if omitted\n"
+        "                    <radio1> radio name is key, the first radio is the default radio\n"
+        "                        <...> settings are passed as arguments to Pi433MHzif\n"
         "                <devices>\n"
         "                    <device1> devicename is key\n"
         "                        <RFout> true if output device, false if input device\n"
+        "                        <dedupe> only for input device, overrides the global dedupe window\n"
+        "                        <outboxlatest> overrides the global outboxlatest\n"
+        "                        <radio> radio name, send on this radio (default the first), receive only from this radio (default all)\n"
         "                        <item433>\n"
         "                            <SysCode> 433MHz sys-code\n"
         "                            <GroupCode> 433MHz group-code (if used)\n"
@@ -202,52 +441,31 @@ class database(object):
         "                            <name> just a name\n"
         "                            <dev_cla> none if omitted, outlet or switch (only for switch), doorbell or button (only for event)\n"
         "                    <device2> ... ")
-        db.append(comment)
 
         XMLpath = self.getNewXMLpath()
-
-        with open(XMLpath, "w") as xml_file:
-            xml_file.write(self.prettify(db))
-
-    def getXMLcomment(self, tag):
-        comment = ""
-        XMLpath = self.getXMLpath()
-        with open(XMLpath, 'r') as xml_file:
-            content = xml_file.read()
-            if tag:
-                xmltag = "<{}>".format(tag)
-                xmlend = "</{}>".format(tag)
-                begin = content.find(xmltag)
-                end = content.find(xmlend)
-                content = content[begin:end]
-            cmttag = "<!--"
-            cmtend = "-->"
-            begin = content.find(cmttag)
-            end = content.find(cmtend)
-            if (begin > -1) and (end > -1):
-                comment = content[begin+len(cmttag):end]
-        return comment
-
-    def prettify(self, elem):
-        """Return a pretty-printed XML string for the Element.
-        """
-        rough_string = ET.tostring(elem, ENCODING)
-        reparsed = parseString(rough_string)
-        return reparsed.toprettyxml(indent="\t").replace('<?xml version="1.0" ?>','<?xml version="1.0" encoding="%s"?>' % ENCODING)
+        self.writeXML(XMLpath, comment, {})
+        self.comment = comment
 
     def getXMLpath(self, doexit = True, dowrite = False):
         etcpath = "/etc/"
         XMLpath = ""
-        # first look in etc
-        if os.path.isfile(os.path.join(etcpath,XML_FILENAME)):
+        # given location, otherwise look in etc
+        if self.xmlpath:
+            if os.path.isfile(self.xmlpath):
+                XMLpath = self.xmlpath
+            else:
+                log.warning("No XML file found")
+                if doexit:
+                    exit(1)
+        elif os.path.isfile(os.path.join(etcpath,XML_FILENAME)):
             XMLpath = os.path.join(etcpath,XML_FILENAME)
             if dowrite and not os.access(XMLpath, os.W_OK):
-                print("No valid writable XML file location found")
-                print("XML file cannot be written, please run as super user")
+                log.warning("No valid writable XML file location found")
+                log.warning("XML file cannot be written, please run as super user")
                 if doexit:
                     exit(1)
         else: # Only allow etc location
-            print("No XML file found")
+            log.warning("No XML file found")
             if doexit:
                 exit(1)
         return XMLpath
@@ -255,13 +473,15 @@ class database(object):
     def getNewXMLpath(self):
         etcpath = "/etc/"
         XMLpath = ""
-        # first look in etc
-        if os.path.exists(etcpath):
+        # given location, otherwise look in etc
+        if self.xmlpath:
+            XMLpath = self.xmlpath
+        elif os.path.exists(etcpath):
             if os.access(etcpath, os.W_OK):
                 XMLpath = os.path.join(etcpath,XML_FILENAME)
         if (not XMLpath):
-            print("No valid writable XML file location found")
-            print("XML file cannot be created, please run as super user")
+            log.warning("No valid writable XML file location found")
+            log.warning("XML file cannot be created, please run as super user")
             exit(1)
         return XMLpath
 
@@ -269,315 +489,2550 @@ class database(object):
 #########################################################
 
 #########################################################
-# Class : mqtt433MHz                                    #
+# Class : frozen                                        #
 #########################################################
-class mqtt433MHz(object):
-    def __init__(self):
-        self.name         = ""
-        self.client       = None
-        self.connected    = False
-        self.rcConnect    = 0
-        self.rcDisconnect = 0
-        self.debug        = False
-        self.headers      = {}
-        self.values       = {}
-        signal.signal(signal.SIGINT, self.exit_app)
-        signal.signal(signal.SIGTERM, self.exit_app)
-        self.term         = False
+class frozen(object):
+    # base for compiled config objects, read only after construction
+    __slots__ = ()
 
-    def __del__(self):
-        pass
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is read only".format(type(self).__name__))
 
-    def __str__(self):
-        return "{}: 433 MHz to MQTT translator".format(self.name)
+    def __delattr__(self, name):
+        raise AttributeError("{} is read only".format(type(self).__name__))
+
+    def init(self, **kwargs):
+        for name, value in kwargs.items():
+            object.__setattr__(self, name, value)
 
     def __repr__(self):
-        return self.__str__()
+        return "{}({})".format(type(self).__name__, ", ".join("{}={!r}".format(name, getattr(self, name)) for name in self.__slots__))
 
-    def run(self, argv):
-        if len(os.path.split(argv[0])) > 1:
-            self.name = os.path.split(argv[0])[1]
-        else:
-            self.name = argv[0]
+#########################################################
 
-        self.db = database()
+#########################################################
+# Class : rfCode                                        #
+#########################################################
+class rfCode(frozen):
+    __slots__ = ("syscode", "groupcode", "devicecode", "key")
 
-        index = 0
-        for arg in argv:
-            if arg[0] == "-":
-                if arg == "-h" or arg == "--help":
-                    self.printHelp()
-                    exit()
-                elif arg == "-v" or arg == "--version":
-                    print(self)
-                    print("Version: {}".format(VERSION))
-                    exit()
-                elif arg == "-d" or arg == "--debug":
-                    self.debug = True
-                    del argv[index]
-                else:
-                    self.parseError(arg)
-            index += 1
-        if len(argv) < 2:
-            if not ifinstalled:
-                print(self)
-                print("MQTT not installed")
-                print("Please install paho mqtt: pip3 install paho-mqtt")
-                print("Terminating")
-                exit(1)
-            if not if433installed:
-                print(self)
-                print("Pi433MHzif not installed")
-                print("Please install Pi433MHzif: see https://github.com/helly1206/Pi433MHz")
-                print("Terminating")
-                exit(1)
-            self.daemon()
-        else:
-            self.parseError(argv[1])
+    def __init__(self, syscode, groupcode, devicecode):
+        self.init(syscode = syscode, groupcode = groupcode, devicecode = devicecode, key = (syscode, groupcode, devicecode))
 
-    def printHelp(self):
-        print(self)
-        print("Usage:")
-        print("    {} {}".format(self.name, "<arguments>"))
-        print("        -h, --help    : Display this help")
-        print("        -v, --version : Display version")
-        print("        -d, --debug   : Debug communication")
-        print("        <no arguments>: run as daemon")
-        print("")
+    def __str__(self):
+        return "SysCode: " + str(self.syscode) + ", GroupCode: " + str(self.groupcode) + ", DeviceCode: " + str(self.devicecode)
 
-    def parseError(self, opt = ""):
-        print(self)
-        print("Invalid option entered")
-        if opt:
-            print(opt)
-        print("Enter '{} -h' for help".format(self.name))
-        exit(1)
+#########################################################
 
-    def daemon(self):
-        self.client = mqttclient.Client("mqtt433MHz_" + format(getnode(),'X')[-6:])  #create new instance
-        self.client.on_message=self.onmessage #attach function to callback
-        self.client.on_connect=self.onconnect  #bind call back function
-        self.client.on_disconnect=self.ondisconnect  #bind call back function
-        self.client.on_log=self.onlog
-        self.client433 = Pi433MHzif.Pi433MHzif()
-
-        if not "broker" in self.db().keys():
-            print("No broker entered, terminating")
-            exit(1)
-        elif not self.db()["broker"]:
-            print("Empty broker entered, terminating")
-            exit(1)
-        else:
-            if "port" in self.db().keys():
-                port = self.db()["port"]
-            else:
-                port = 1883
-            if "username" in self.db().keys():
-                if self.db()["username"]:
-                    password = None
-                    if "password" in self.db().keys():
-                        if self.db()["password"]:
-                            password = self.db()["password"]
-                    self.client.username_pw_set(self.db()["username"], password=password)
-            try:
-                self.client.connect(self.db()["broker"], port=int(port)) #connect to broker
-                self.client.loop_start() #start the loop
-            except:
-                print("Invalid connection, check server address")
-                exit(1)
+#########################################################
+# Class : mqttTopics                                    #
+#########################################################
+class mqttTopics(frozen):
+    __slots__ = ("main", "cmd", "stat", "cmdrel", "statrel")
 
-        ####### Subscribe topics
-        for key, topic in self.getCmdTopics().items():
-            self.client.subscribe(topic)
-            if self.debug:
-                print("MQTT: subscribed [" + key + "]: " + topic)
-        self.client.subscribe(self.joinTopic(self.db()["hatopic"], HASTATUS))
-        
-        ####### Write disco topics
-        for key, disco in self.getHaDiscos().items():
-            self.client.publish(disco["topic"], json.dumps(disco["disco"]), QOS, RETAIN)
-            if self.debug:
-                print("MQTT: HA Discovery [" + disco["topic"] + "]: " + json.dumps(disco["disco"]))
+    def __init__(self, main, cmdrel, statrel):
+        self.init(main = main, cmdrel = cmdrel, statrel = statrel,
+                  cmd = main + "/" + cmdrel if cmdrel else "",
+                  stat = main + "/" + statrel if statrel else "")
 
-        read433 = True if len(self.get433Inputs())>0 else False
-        res = -1
-        array = []
-        while not self.term:
-            if read433:
-                res, array = self.client433.ReadMessage(4)
-            if res>0:
-                syscode, groupcode, devicecode, val = self.array2code(array)
-                value = json.dumps({"event_type": str(val)})
-                for key, input in self.get433Inputs().items():
-                    if (input["SysCode"] == syscode) and (input["GroupCode"] == groupcode) and (input["DeviceCode"] == devicecode):
-                        self.client.publish(input["stat"], value, QOS, RETAINEVENT) # value doesn't matter I geuss, retain should be false 
-                        if self.debug:
-                            print("433MHz: received: SysCode: " + str(syscode) + ", GroupCode: " + str(groupcode) + ", DeviceCode: " + str(devicecode), " value: " + str(val))
-                            print("MQTT: publish event: " + input["stat"] + "/" + value)
-                        break
+#########################################################
+
+#########################################################
+# Class : haDisco                                       #
+#########################################################
+class haDisco(frozen):
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.init(topic = topic, payload = payload)
+
+#########################################################
+
+#########################################################
+# Class : rfEvent                                       #
+#########################################################
+class rfEvent(frozen):
+    # received value of an input device, payload ready to publish
+    __slots__ = ("device", "value", "payload", "key")
+
+    def __init__(self, device, value, payload, key):
+        self.init(device = device, value = value, payload = payload, key = key)
+
+#########################################################
+
+#########################################################
+# Class : rfCommand                                     #
+#########################################################
+class rfCommand(frozen):
+    # command payload of an output device, frame ready to send (None if encoded when sent)
+    __slots__ = ("value", "payload", "frame")
+
+    def __init__(self, value, payload, frame):
+        self.init(value = value, payload = payload, frame = frame)
+
+#########################################################
+
+#########################################################
+# Class : rfDevice                                      #
+#########################################################
+class rfDevice(frozen):
+    __slots__ = ("name", "rfout", "code", "topics", "disco", "dedupe", "radio", "rxkey", "latest", "commands")
+
+    def __init__(self, name, rfout, code, topics, disco, dedupe, radio, rxkey, latest, commands):
+        self.init(name = name, rfout = rfout, code = code, topics = topics, disco = disco, dedupe = dedupe, radio = radio, rxkey = rxkey, latest = latest,
+                  commands = commands)
+
+#########################################################
+
+#########################################################
+# Class : compiledConfig                                #
+#########################################################
+class compiledConfig(frozen):
+    __slots__ = ("version", "devices", "inputs", "frames", "commands", "discos", "hatopic", "haStatusTopic", "dedupe", "brokers", "radios", "multiRadio")
+
+    def __init__(self, db, nodeId, version = 0, skipped = {}):
+        hatopic = self.text(db.get("hatopic", ""), "hatopic", False) or HATOPIC
+        dedupe = self.number(db.get("dedupe", ""), "dedupe", DEDUPE)
+        radios = self.compileRadios(db.get("radios", ""))
+        latest = self.flag(db.get("outboxlatest", ""), "outboxlatest", False)
+        devices = []
+        inputs = {}
+        frames = {}
+        commands = {}
+        discos = []
+        rawdevices = db.get("devices", {})
+        if not isinstance(rawdevices, dict):
+            rawdevices = {}
+        for name, raw in rawdevices.items():
+            if name in skipped:
+                # reported when loaded
+                continue
+            try:
+                device = self.compileDevice(name, raw, hatopic, nodeId, dedupe, radios, latest)
+            except ValueError as e:
+                log.warning("Device [%s] skipped: %s", name, e)
+                continue
+            if device.rfout:
+                if device.topics.cmd in commands:
+                    log.warning("Device [%s] skipped: command topic already used by [%s]", name, commands[device.topics.cmd].name)
+                    continue
+                commands[device.topics.cmd] = device
             else:
-                time.sleep(SLEEPTIME)     
+                if device.rxkey in inputs:
+                    log.warning("Device [%s] skipped: 433MHz code already used by [%s]", name, inputs[device.rxkey].name)
+                    continue
+                inputs[device.rxkey] = device
+                self.compileFrames(frames, device)
+            devices.append(device)
+            if device.disco:
+                discos.append(device.disco)
+        self.init(version = version,
+                  devices = tuple(devices),
+                  inputs = MappingProxyType(inputs),
+                  frames = MappingProxyType(frames),
+                  commands = MappingProxyType(commands),
+                  discos = tuple(discos),
+                  hatopic = hatopic,
+                  haStatusTopic = hatopic + "/" + HASTATUS,
+                  dedupe = max([device.dedupe for device in inputs.values()], default = 0),
+                  brokers = self.compileBrokers(db),
+                  radios = radios,
+                  multiRadio = len(radios) > 1)
 
-        #signal.pause()
-        if self.client:
-            ####self.client.wait_for_publish() # wait for all messages published
-            self.client.loop_stop()    #Stop loop
-            self.client.disconnect() # disconnect
+    def compileBrokers(self, db):
+        # broker name --> connection settings, the top level settings are the only broker if <brokers> is omitted
+        raw = db.get("brokers", "")
+        if not isinstance(raw, dict) or not raw:
+            raw = {DEFAULTBROKER: db}
+        brokers = {}
+        for index, (name, settings) in enumerate(raw.items()):
+            settings = settings if isinstance(settings, dict) else {}
+            # qos and persistent default to the top level settings, and so does the first broker's outbox file
+            inherit = ("qos", "persistent", "outboxfile") if index == 0 else ("qos", "persistent")
+            compiled = dict((key, db[key]) for key in inherit if db.get(key, "") != "")
+            compiled.update((key, settings[key]) for key in BROKERKEYS if settings.get(key, "") != "")
+            brokers[name] = MappingProxyType(compiled)
+        return MappingProxyType(brokers)
 
-    def exit_app(self, signum, frame):
-        print("Terminating ...")
-        self.term = True
-        pass
+    def compileRadios(self, raw):
+        # radio name --> arguments for Pi433MHzif, first radio is the default
+        if not isinstance(raw, dict) or not raw:
+            return MappingProxyType({DEFAULTRADIO: MappingProxyType({})})
+        radios = {}
+        for name, args in raw.items():
+            radios[name] = MappingProxyType(dict(args) if isinstance(args, dict) else {})
+        return MappingProxyType(radios)
 
-    def onlog(self, client, userdata, level, buf):
-        if self.debug:
-            print(buf)
+    @classmethod
+    def checkDevice(cls, raw):
+        # settings of the device itself, ValueError with the reason if invalid
+        if not isinstance(raw, dict):
+            raise ValueError("no device settings")
+        if not "RFout" in raw:
+            raise ValueError("missing <RFout>")
+        rfout = bool(raw["RFout"])
+        item433 = cls.section(raw, "item433")
+        code = rfCode(cls.integer(item433.get("SysCode", 0), "SysCode"),
+                      cls.integer(item433.get("GroupCode", 0), "GroupCode"),
+                      cls.integer(item433.get("DeviceCode", ""), "DeviceCode"))
+        itemmqtt = cls.section(raw, "itemmqtt")
+        main = cls.text(itemmqtt.get("maintopic", ""), "maintopic")
+        topics = mqttTopics(main,
+                            cls.text(itemmqtt.get("cmd_t", itemmqtt.get("command_topic", "")), "cmd_t", False),
+                            cls.text(itemmqtt.get("stat_t", itemmqtt.get("status_topic", "")), "stat_t", False))
+        if rfout and not topics.cmd:
+            raise ValueError("output device without <cmd_t>")
+        if not rfout and not topics.stat:
+            raise ValueError("input device without <stat_t>")
+        return rfout, code, topics
 
-    def onmessage(self, client, userdata, message):
-        output = {}
+    def compileDevice(self, name, raw, hatopic, nodeId, dedupe, radios, latest):
+        rfout, code, topics = self.checkDevice(raw)
+        try:
+            disco = self.compileDisco(raw, rfout, topics, hatopic, nodeId)
+        except ValueError as e:
+            log.info("Device [%s] no HA discovery: %s", name, e)
+            disco = None
+        radio = self.text(raw.get("radio", ""), "radio", False)
+        if radio and not radio in radios:
+            raise ValueError("unknown <radio>: " + radio)
+        # with a single radio every input is received on it
+        rxkey = (radio,) + code.key if radio and len(radios) > 1 else code.key
+        return rfDevice(name, rfout, code, topics, disco,
+                        0.0 if rfout else self.number(raw.get("dedupe", ""), "dedupe", dedupe),
+                        radio or next(iter(radios)), rxkey,
+                        self.flag(raw.get("outboxlatest", ""), "outboxlatest", latest),
+                        self.compileCommands(code) if rfout else MappingProxyType({}))
 
-        if self.joinTopic(self.db()["hatopic"], HASTATUS) == message.topic:
-            if message.payload.decode('utf-8') == HAONLINE:
-                if self.debug:
-                    print("MQTT: received HA online, issue HA Discovery")
-                ####### Write disco topics
-                for key, disco in self.getHaDiscos().items():
-                    self.client.publish(disco["topic"], json.dumps(disco["disco"]), QOS, RETAIN)
-                    if self.debug:
-                        print("MQTT: HA Discovery [" + disco["topic"] + "]: " + json.dumps(disco["disco"]))
+    def compileFrames(self, frames, device):
+        # every frame array2code decodes to the device's code, so a received frame is a single lookup
+        radio = device.rxkey[:-len(device.code.key)]
+        code = device.code
+        for value in RFVALUES:
+            event = rfEvent(device, value, self.eventPayload(value), code.key + (value,))
+            frames[radio + (code.syscode, code.groupcode, code.devicecode, value)] = event
+            if not code.groupcode:
+                frames[radio + (code.syscode, code.devicecode, value)] = event
+                if not code.syscode:
+                    frames[radio + (code.devicecode, value)] = event
+
+    def compileCommands(self, code):
+        # command payload --> frame, the frames are sent as is, never modified
+        commands = {}
+        for value in RFVALUES:
+            payload = str(value).encode(ENCODING)
+            commands[payload] = rfCommand(str(value), payload, self.txFrame(code, value))
+        return MappingProxyType(commands)
+
+    def eventPayload(self, value):
+        return json.dumps({"event_type": str(value)}).encode(ENCODING)
+
+    def txFrame(self, code, value):
+        # as code2array, sys- and group-code are left out if 0
+        return [number for number in (code.syscode, code.groupcode) if number > 0] + [code.devicecode, value]
+
+    def compileDisco(self, raw, rfout, topics, hatopic, nodeId):
+        hadevice = self.section(raw, "hadevice")
+        hadisco = self.section(raw, "hadisco")
+        hatype = self.text(raw.get("hatype", ""), "hatype")
+        discoName = self.text(hadisco.get("name", ""), "hadisco name")
+        devcla = self.text(hadisco.get("dev_cla", ""), "dev_cla")
+        # copies, the parsed config itself is never touched
+        dev = dict(hadevice)
+        dev["ids"] = [nodeId + "_" + discoName]
+        payload = dict(hadisco)
+        payload["~"] = topics.main
+        payload["uniq_id"] = nodeId + "_" + discoName
+        if rfout:
+            payload["cmd_t"] = "~/" + topics.cmdrel
+        if topics.statrel:
+            payload["stat_t"] = "~/" + topics.statrel
+        if rfout:
+            payload["pl_on"] = "1"
+            payload["pl_off"] = "0"
+        else:
+            payload["event_types"] = ["1", "0"]
+        payload["dev"] = dev
+        topic = hatopic + "/" + hatype + "/" + discoName + "_" + devcla + "/" + CONFIG
+        return haDisco(topic, json.dumps(payload).encode(ENCODING))
+
+    @staticmethod
+    def section(raw, tag):
+        if not isinstance(raw.get(tag), dict):
+            raise ValueError("missing <" + tag + ">")
+        return raw[tag]
+
+    @staticmethod
+    def integer(value, tag):
+        if value == "":
+            raise ValueError("missing <" + tag + ">")
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError("<" + tag + "> is not an integer: " + str(value))
+        return value
+
+    @staticmethod
+    def number(value, tag, default):
+        if value == "":
+            return float(default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("<" + tag + "> is not a number: " + str(value))
+        return float(value)
+
+    @staticmethod
+    def flag(value, tag, default):
+        if value == "":
+            return default
+        if not isinstance(value, (bool, int)):
+            raise ValueError("<" + tag + "> is not true or false: " + str(value))
+        return bool(value)
+
+    @staticmethod
+    def text(value, tag, required = True):
+        if value == "" or isinstance(value, dict):
+            if required:
+                raise ValueError("missing <" + tag + ">")
+            return ""
+        return str(value)
+
+#########################################################
+
+#########################################################
+# Class : backoff                                       #
+#########################################################
+class backoff(object):
+    # exponential delays, half fixed and half random to spread the clients reconnecting to a broker
+    def __init__(self, first = RECONNECTDELAY, maximum = RECONNECTMAXDELAY):
+        self.first   = max(0.1, first)
+        self.maximum = max(self.first, maximum)
+        self.attempt = 0
+
+    def next(self):
+        import random
+        delay = min(self.maximum, self.first * 2 ** min(self.attempt, 32))
+        self.attempt += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempt = 0
+
+#########################################################
+
+#########################################################
+# Class : startupTimer                                  #
+#########################################################
+class startupTimer(object):
+    def __init__(self, start = IMPORTSTART):
+        self.start  = start
+        self.last   = start
+        self.phases = []
+        self.events = {}
+        self.reported = False
+        self.lock   = threading.Lock()
+
+    def mark(self, phase):
+        # phase ends now, started at the previous mark
+        now = time.monotonic()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def event(self, name):
+        # first occurrence only, relative to start
+        if not name in self.events:
+            self.events[name] = time.monotonic() - self.start
+
+    def reportOnce(self):
+        # events may complete on different threads
+        with self.lock:
+            if self.reported:
                 return
+            self.reported = True
+        self.report()
+
+    def report(self):
+        log.info("Startup report:")
+        for phase, duration in self.phases:
+            log.info("    %-20s: %8.1f ms", phase, duration * 1000)
+        log.info("    %-20s: %8.1f ms", "total", (self.last - self.start) * 1000)
+        for name, offset in self.events.items():
+            log.info("    %-20s: %8.1f ms after start", name, offset * 1000)
 
-        for key, topic in self.getCmdTopics().items():
-            if topic == message.topic:
-                output = self.get433Outputs()[key]
+#########################################################
+
+#########################################################
+# Class : radioReader                                   #
+#########################################################
+class radioReader(object):
+    # drains one radio and paces the polls, shared by the RX thread and the asyncio RX task
+    def __init__(self, radio, name = DEFAULTRADIO, poll = RXPOLLMAX):
+        self.radio = radio
+        self.name  = name
+        self.poll  = poll
+        self.wait  = min(RXPOLLTIME, poll)
+        self.fd    = self.getfd()
+        self.clock = self.getclock()
+
+    def drain(self, handle):
+        # every pending frame to handle(array, radio name, received, frame time), returns the seconds until the next poll
+        res, array = self.radio.ReadMessage(RXSIZE)
+        if res > 0:
+            self.wait = min(RXPOLLTIME, self.poll)
+            while res > 0:
+                handle(array, self.name, time.monotonic(), self.clock())
+                res, array = self.radio.ReadMessage(RXSIZE)
+            return self.wait
+        # back off while idle, a frame restarts at the short interval
+        wait = self.wait
+        self.wait = min(self.wait * 2, self.poll)
+        return wait
+
+    def getfd(self):
+        # use the transceiver's file descriptor if the interface offers one
+        try:
+            return self.radio.fileno()
+        except:
+            return -1
+
+    def getclock(self):
+        # a replayed radio stamps its frames with the capture time, others with the time they are read
+        try:
+            self.radio.frameTime()
+            return self.radio.frameTime
+        except:
+            return time.monotonic
+
+#########################################################
+
+#########################################################
+# Class : rxWorker                                      #
+#########################################################
+class rxWorker(threading.Thread):
+    def __init__(self, radio, frames, enabled = True, name = DEFAULTRADIO, term = None, poll = RXPOLLMAX):
+        threading.Thread.__init__(self, name = "rxWorker_" + name, daemon = True)
+        self.reader    = radioReader(radio, name, poll)
+        self.frames    = frames
+        self.enabled   = enabled
+        self.stopped   = False
+        self.term      = term if term else threading.Event() # shared, a stop before start is not missed
+        self.wakeEvent = threading.Event()
+
+    def run(self):
+        poller = None
+        if self.reader.fd >= 0:
+            poller = select.poll()
+            poller.register(self.reader.fd, select.POLLIN | select.POLLPRI)
+        while not self.stopped and not self.term.is_set():
+            if not self.enabled:
+                # no input devices, sleep until enabled or stopped
+                self.wakeEvent.wait()
+                self.wakeEvent.clear()
+                continue
+            wait = self.reader.drain(self.handle)
+            if poller:
+                poller.poll(RXFDTIMEOUT * 1000)
+            elif self.wakeEvent.wait(wait):
+                self.wakeEvent.clear()
+        self.frames.put(None) # wake up consumer
+
+    def handle(self, array, name, received, frametime):
+        self.frames.put((array, name, received, frametime))
+
+    def enable(self, enabled = True):
+        self.enabled = enabled
+        self.wakeEvent.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeEvent.set()
+
+#########################################################
+
+#########################################################
+# Class : frameCapture                                  #
+#########################################################
+class frameCapture(object):
+    # binary append log of received frames:
+    # CAPTUREMAGIC once, then records of time (double), radio index, number of values, values (int32)
+    # a record without values marks the start of a capture session
+    def __init__(self, path):
+        self.lock   = threading.Lock()
+        self.file   = open(path, "ab")
+        self.frames = 0
+        if self.file.tell() == 0:
+            self.file.write(CAPTUREMAGIC)
+        self.file.write(CAPTUREHEADER.pack(time.monotonic(), 0, 0))
+        self.file.flush()
+
+    def write(self, index, array, received):
+        record = CAPTUREHEADER.pack(received, index, len(array)) + struct.pack("<" + str(len(array)) + "i", *array)
+        with self.lock:
+            if self.file:
+                self.file.write(record)
+                self.file.flush()
+                self.frames += 1
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    @staticmethod
+    def read(path):
+        # (session start, time, radio index, array) of every record
+        capture_file = open(path, "rb")
+        if capture_file.read(len(CAPTUREMAGIC)) != CAPTUREMAGIC:
+            capture_file.close()
+            raise ValueError("not a capture file: " + path)
+        return frameCapture.records(capture_file)
+
+    @staticmethod
+    def records(capture_file):
+        with capture_file:
+            while True:
+                header = capture_file.read(CAPTUREHEADER.size)
+                if len(header) < CAPTUREHEADER.size:
+                    return
+                received, index, size = CAPTUREHEADER.unpack(header)
+                values = capture_file.read(4 * size)
+                if len(values) < 4 * size:
+                    return # truncated by a crash
+                yield size == 0, received, index, list(struct.unpack("<" + str(size) + "i", values))
+
+#########################################################
+
+#########################################################
+# Class : captureRadio                                  #
+#########################################################
+class captureRadio(object):
+    # records every frame read from the wrapped radio
+    def __init__(self, radio, capture, index):
+        self.radio   = radio
+        self.capture = capture
+        self.index   = index
+
+    def ReadMessage(self, size):
+        res, array = self.radio.ReadMessage(size)
+        if res > 0:
+            self.capture.write(self.index, array, time.monotonic())
+        return res, array
+
+    def WriteMessage(self, array, size):
+        return self.radio.WriteMessage(array, size)
+
+    def fileno(self):
+        return self.radio.fileno()
+
+    def frameTime(self):
+        return self.radio.frameTime()
+
+#########################################################
+
+#########################################################
+# Class : replayRadio                                   #
+#########################################################
+class replayRadio(object):
+    # plays the frames of one radio from a capture file instead of a transceiver
+    def __init__(self, path, speed, index, debug = False):
+        self.records = (record for record in frameCapture.read(path) if record[0] or record[2] == index)
+        self.speed   = speed # 1 is real time, 0 as fast as they are read
+        self.index   = index
+        self.debug   = debug
+        self.next    = None
+        self.base    = None # (capture time, replay time) of the current session
+        self.start   = time.monotonic()
+        self.offset  = 0    # capture seconds of the earlier sessions
+        self.elapsed = 0    # capture seconds of the current session
+        self.frames  = 0
+        self.done    = False
+
+    def ReadMessage(self, size):
+        while self.next == None:
+            record = next(self.records, None)
+            if record == None:
+                if not self.done:
+                    self.done = True
+                    log.info("Replay [%s] finished, frames: %s", self.index, self.frames)
+                return 0, []
+            if record[0]:
+                # new session, monotonic time restarted
+                self.base     = None
+                self.offset  += self.elapsed
+                self.elapsed  = 0
+            else:
+                self.next = record
+        session, received, index, array = self.next
+        now = time.monotonic()
+        if self.base == None:
+            self.base = (received, now)
+        if self.speed > 0 and now < self.base[1] + (received - self.base[0]) / self.speed:
+            return 0, []
+        self.next = None
+        self.elapsed = received - self.base[0]
+        self.frames += 1
+        return len(array), array
+
+    def frameTime(self):
+        # capture time of the last frame read, at any speed frames keep their spacing on site
+        return self.start + self.offset + self.elapsed
+
+    def WriteMessage(self, array, size):
+        if self.debug:
+            log.debug("Replay [%s]: TX %s", self.index, array)
+        return size
+
+#########################################################
+
+#########################################################
+# Class : configWatcher                                 #
+#########################################################
+class configWatcher(threading.Thread):
+    def __init__(self, path, interval, onchange):
+        threading.Thread.__init__(self, name = "configWatcher", daemon = True)
+        self.path         = path
+        self.interval     = interval if interval > 0 else None
+        self.onchange     = onchange
+        self.stopped      = False
+        self.triggerEvent = threading.Event()
+        self.fingerprint  = self.getFingerprint()
+
+    def run(self):
+        while not self.stopped:
+            triggered = self.triggerEvent.wait(self.interval)
+            self.triggerEvent.clear()
+            if self.stopped:
                 break
-        if output:
-            value = message.payload.decode('utf-8')
-            self.send433MHz(output["SysCode"], output["GroupCode"], output["DeviceCode"], value)  
-            if "stat" in output:
-                # as current state is unknown, just copy value to stat
-                self.client.publish(output["stat"], value, QOS, RETAIN)
-            if self.debug:
-                print("MQTT: received cmd: " + output["cmd"] + "/" + str(value))
-                print("433MHz: send: SysCode: " + str(output["SysCode"]) + ", GroupCode: " + str(output["GroupCode"]) + ", DeviceCode: " + str(output["DeviceCode"]))
-                print("MQTT: publish stat: " + output["stat"] + "/" + str(value))
-            
-        
-    def onconnect(self, client, userdata, flags, rc):
-        if rc == 0:
-            print("Connected OK, Returned code = " + str(rc))
-            self.connected = True
-            self.rcDisconnect = 0
-        else:
-            if self.rcConnect != rc:
-                print("Bad connection, Returned code = " + str(rc))
-            self.connected = False
-        self.rcConnect = rc
+            fingerprint = self.getFingerprint()
+            if triggered or fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                try:
+                    self.onchange()
+                except Exception as e:
+                    log.warning("Reload failed: %s", e)
 
-    def ondisconnect(self, client, userdata, rc):
-        if rc == 0 or self.rcDisconnect != rc:
-            print("Disconnected, Returned code = " + str(rc))
-            self.rcConnect = 0
-        self.connected = False
-        self.rcDisconnect = rc
-
-    def getCmdTopics(self):
-        cmdtopics = {}
-        for key, device in self.db()["devices"].items():
-            try:
-                if "cmd_t" in device["itemmqtt"].keys():
-                    cmdtopics[key] = self.joinTopic(device["itemmqtt"]["maintopic"],device["itemmqtt"]["cmd_t"])
-                elif  "command_topic" in device["itemmqtt"].keys():
-                    cmdtopics[key] = self.joinTopic(device["itemmqtt"]["maintopic"],device["itemmqtt"]["command_topic"])
-            except:
-                pass
-        return cmdtopics
-    
-    def getHaDiscos(self):
-        discos = {}
-        for key, device in self.db()["devices"].items():
-            try:
-                disco = {}
-                ids = format(getnode(),'X')[-6:]
-                dev = device["hadevice"]
-                dev["ids"] = [ids + "_" + device["hadisco"]["name"]]
-                hadisco = device["hadisco"]
-                hadisco["~"] = device["itemmqtt"]["maintopic"]
-                hadisco["uniq_id"] = ids + "_" + device["hadisco"]["name"]
-                if device["RFout"]:
-                    if "cmd_t" in device["itemmqtt"].keys():
-                        hadisco["cmd_t"] = self.joinTopic("~",device["itemmqtt"]["cmd_t"])
-                    elif "command_topic" in device["itemmqtt"].keys():
-                        hadisco["cmd_t"] = self.joinTopic("~",device["itemmqtt"]["command_topic"])
-                if "stat_t" in device["itemmqtt"].keys():
-                    hadisco["stat_t"] = self.joinTopic("~",device["itemmqtt"]["stat_t"])
-                elif "status_topic" in device["itemmqtt"].keys():
-                    hadisco["stat_t"] = self.joinTopic("~",device["itemmqtt"]["status_topic"])  
-                if device["RFout"]:
-                    hadisco["pl_on"] = "1"
-                    hadisco["pl_off"] = "0"
+    def trigger(self):
+        # safe to call from a signal handler
+        self.triggerEvent.set()
+
+    def stop(self):
+        self.stopped = True
+        self.triggerEvent.set()
+
+    def getFingerprint(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+#########################################################
+
+#########################################################
+# Class : txQueue                                       #
+#########################################################
+class txQueue(object):
+    def __init__(self, size = TXQUEUESIZE, overflow = TXOVERFLOW, window = TXCOALESCE):
+        self.size      = max(1, int(size))
+        self.overflow  = overflow if overflow in [TXBLOCK, TXDROPOLDEST, TXREJECT] else TXOVERFLOW
+        self.window    = max(0.0, float(window))
+        self.items     = deque() # [key, item, time queued]
+        self.pending   = {}      # key --> queued entry, only when coalescing
+        self.cond      = threading.Condition()
+        self.closed    = False
+        self.dropped   = 0
+        self.rejected  = 0
+        self.coalesced = 0
+        self.maxdepth  = 0
+
+    def __len__(self):
+        return self.depth()
+
+    def depth(self):
+        with self.cond:
+            return len(self.items)
+
+    def put(self, item, key = None, block = True):
+        # returns False if the item is not queued, without block a full queue rejects instead of waiting
+        with self.cond:
+            if self.closed:
+                return False
+            if self.window > 0 and key in self.pending:
+                # replace the pending command by the latest one, keep its place in the queue
+                self.pending[key][1] = item
+                self.coalesced += 1
+                return True
+            if len(self.items) >= self.size:
+                if self.overflow == TXREJECT:
+                    self.rejected += 1
+                    return False
+                elif self.overflow == TXDROPOLDEST:
+                    self.unpend(self.items.popleft())
+                    self.dropped += 1
+                elif not block:
+                    self.rejected += 1
+                    return False
                 else:
-                    hadisco["event_types"] = ["1", "0"]
-                hadisco["dev"] = dev
-                disco["disco"] = hadisco
-                disco["topic"] = self.joinTopic(self.joinTopic(self.joinTopic(self.db()["hatopic"],device["hatype"]), device["hadisco"]["name"] + "_" + device["hadisco"]["dev_cla"]), CONFIG)
-                discos[key] = disco
-            except:
-                pass
+                    # the caller is the MQTT loop, so block only briefly
+                    end = time.monotonic() + TXBLOCKTIME
+                    while len(self.items) >= self.size and not self.closed:
+                        wait = end - time.monotonic()
+                        if wait <= 0:
+                            self.rejected += 1
+                            return False
+                        self.cond.wait(wait)
+                    if self.closed:
+                        return False
+            entry = [key, item, time.monotonic()]
+            self.items.append(entry)
+            if self.window > 0 and key != None:
+                self.pending[key] = entry
+            self.maxdepth = max(self.maxdepth, len(self.items))
+            self.cond.notify_all()
+            return True
+
+    def get(self):
+        # blocks until an item is available (and its coalescing window passed), None when closed
+        with self.cond:
+            while not self.closed:
+                if self.items:
+                    wait = self.items[0][2] + self.window - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.cond.wait(wait)
+                else:
+                    self.cond.wait()
+            if self.closed:
+                return None
+            entry = self.items.popleft()
+            self.unpend(entry)
+            self.cond.notify_all()
+            return entry[1]
+
+    def unpend(self, entry):
+        if entry[0] != None and self.pending.get(entry[0]) is entry:
+            del self.pending[entry[0]]
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+#########################################################
+
+#########################################################
+# Class : radioLink                                     #
+#########################################################
+class radioLink(object):
+    # one transceiver with its own command queue and RX/TX workers
+    def __init__(self, name, radio, commands):
+        self.name     = name
+        self.radio    = radio
+        self.commands = commands
+        self.rxWorker = None
+        self.txWorker = None
+        self.executor = None
+
+    def __str__(self):
+        return self.name
+
+#########################################################
+
+#########################################################
+# Class : brokerLink                                    #
+#########################################################
+class brokerLink(object):
+    # one MQTT broker with its own client, session state and outbox, a slow broker never holds up another one
+    def __init__(self, name, settings, primary):
+        self.name         = name
+        self.settings     = settings
+        self.primary      = primary # traced, the others' message ids are not
+        self.host         = settings.get("broker", "")
+        self.port         = int(settings.get("port", 1883))
+        self.qos          = min(2, max(0, int(settings.get("qos", QOS))))
+        self.persistent   = bool(settings.get("persistent", False))
+        prefix            = str(settings.get("prefix", "")).strip("/")
+        self.prefix       = prefix + "/" if prefix else ""
+        self.client       = None
+        self.connected    = False
+        self.rcConnect    = 0
+        self.rcDisconnect = 0
+        self.sent         = 0
+        self.acked        = 0
+        self.outbox       = None
+        self.flusher      = None
+        self.discoLock    = threading.Lock()
+        self.discoTask    = None
+        self.sockClosed   = None
+        self.discoCache   = {} # config version --> discovery payloads for this broker
+
+    def __str__(self):
+        return self.name
+
+    def topic(self, topic):
+        return self.prefix + topic if self.prefix else topic
+
+    def localTopic(self, topic):
+        # topic without the prefix, None if not one of ours
+        if not self.prefix:
+            return topic
+        return topic[len(self.prefix):] if topic.startswith(self.prefix) else None
+
+    def subQos(self):
+        # for a persistent session, the broker only queues QoS>0 messages
+        return max(self.qos, SUBQOS) if self.persistent else self.qos
+
+    def discos(self, config):
+        # disco topic --> payload, with a prefix the device topics ("~") move along, built once per config version
+        discos = self.discoCache.get(config.version)
+        if discos != None:
+            return discos
+        discos = OrderedDict()
+        for disco in config.discos:
+            payload = disco.payload
+            if self.prefix:
+                content = json.loads(payload)
+                content["~"] = self.prefix + content["~"]
+                payload = json.dumps(content).encode(ENCODING)
+            discos[disco.topic] = payload
+        # a reload compares the old and the new version, older ones are not needed
+        for version in [version for version in list(self.discoCache.keys()) if version < config.version - 1]:
+            self.discoCache.pop(version, None)
+        self.discoCache[config.version] = discos
         return discos
-    
-    def get433Inputs(self):
-        inputs = {}
-        for key, device in self.db()["devices"].items():
+
+#########################################################
+
+#########################################################
+# Class : txWorker                                      #
+#########################################################
+class txWorker(threading.Thread):
+    def __init__(self, link, transmit):
+        threading.Thread.__init__(self, name = "txWorker_" + link.name, daemon = True)
+        self.link     = link
+        self.commands = link.commands
+        self.transmit = transmit
+
+    def run(self):
+        self.serve(self.link, self.transmit)
+
+    @staticmethod
+    def serve(link, transmit):
+        # transmit until the queue is closed, also the TX loop of asyncio mode on the radio's executor
+        item = link.commands.get()
+        while item != None:
             try:
-                if not device["RFout"]:
-                    input = {}
-                    if "stat_t" in device["itemmqtt"].keys():
-                        input["stat"] = self.joinTopic(device["itemmqtt"]["maintopic"],device["itemmqtt"]["stat_t"])
-                    elif "status_topic" in device["itemmqtt"].keys():
-                        input["stat"] = self.joinTopic(device["itemmqtt"]["maintopic"],device["itemmqtt"]["status_topic"])
-                    if "SysCode" in device["item433"].keys():
-                        input["SysCode"] = device["item433"]["SysCode"]
-                    if "GroupCode" in device["item433"].keys():
-                        input["GroupCode"] = device["item433"]["GroupCode"]
-                    if "DeviceCode" in device["item433"].keys():
-                        input["DeviceCode"] = device["item433"]["DeviceCode"]
-                    inputs[key] = input
-            except:
+                transmit(link, *item)
+            except Exception as e:
+                log.warning("433MHz: send failed: %s", e)
+            item = link.commands.get()
+
+#########################################################
+
+#########################################################
+# Class : dedupeFilter                                  #
+#########################################################
+class dedupeFilter(object):
+    def __init__(self, maxwindow = DEDUPE, maxsize = DEDUPEMAX):
+        self.maxwindow  = maxwindow
+        self.maxsize    = maxsize
+        self.seen       = OrderedDict() # (code, value) --> time accepted, oldest first
+        self.suppressed = 0
+        self.counts     = {}            # device --> frames suppressed
+
+    def __len__(self):
+        return len(self.seen)
+
+    def suppress(self, key, window, device = "", now = None):
+        # True if an identical frame was accepted less than window seconds ago
+        if now == None:
+            now = time.monotonic()
+        self.prune(now)
+        accepted = self.seen.get(key)
+        if accepted != None and now - accepted < window:
+            self.suppressed += 1
+            self.counts[device] = self.counts.get(device, 0) + 1
+            return True
+        self.seen[key] = now
+        self.seen.move_to_end(key)
+        if len(self.seen) > self.maxsize:
+            self.seen.popitem(last = False)
+        return False
+
+    def prune(self, now):
+        while self.seen:
+            key, accepted = next(iter(self.seen.items()))
+            if now - accepted < self.maxwindow:
+                break
+            del self.seen[key]
+
+#########################################################
+
+#########################################################
+# Class : histogram                                     #
+#########################################################
+class histogram(object):
+    # fixed buckets, updated under the metrics lock
+    def __init__(self, buckets = METRICBUCKETS):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets) + 1)
+        self.sum     = 0.0
+        self.count   = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+#########################################################
+
+#########################################################
+# Class : metrics                                       #
+#########################################################
+class metrics(object):
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.started    = time.time()
+        self.counters   = OrderedDict((name, 0) for name in METRICCOUNTERS)
+        self.histograms = OrderedDict((name, histogram()) for name in METRICHISTOGRAMS)
+        self.gauges     = OrderedDict() # name --> (function returning {label value: value}, label)
+
+    def inc(self, name, value = 1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.histograms[name].observe(seconds)
+
+    def gauge(self, name, function, label = "radio"):
+        self.gauges[name] = (function, label)
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict((name, (list(hist.cumulative()), hist.sum, hist.count)) for name, hist in self.histograms.items())
+        snapshot = {"uptime": round(time.time() - self.started, 1)}
+        snapshot.update(counters)
+        for name, (buckets, total, count) in histograms.items():
+            snapshot[name] = {"count": count,
+                              "avg_ms": round(total / count * 1000, 3) if count else 0,
+                              "buckets_ms": dict(zip([str(int(bucket * 1000)) for bucket in METRICBUCKETS] + ["inf"], buckets))}
+        for name, (function, label) in self.gauges.items():
+            snapshot[name] = function()
+        return snapshot
+
+    def prometheus(self):
+        # text exposition format
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict((name, (list(hist.cumulative()), hist.sum, hist.count)) for name, hist in self.histograms.items())
+        lines = []
+        for name, value in counters.items():
+            lines.append("# HELP " + METRICPREFIX + name + "_total " + METRICCOUNTERS[name])
+            lines.append("# TYPE " + METRICPREFIX + name + "_total counter")
+            lines.append(METRICPREFIX + name + "_total " + str(value))
+        for name, (buckets, total, count) in histograms.items():
+            lines.append("# HELP " + METRICPREFIX + name + "_seconds " + METRICHISTOGRAMS[name])
+            lines.append("# TYPE " + METRICPREFIX + name + "_seconds histogram")
+            for bound, value in zip([repr(bucket) for bucket in METRICBUCKETS] + ["+Inf"], buckets):
+                lines.append(METRICPREFIX + name + "_seconds_bucket{le=\"" + bound + "\"} " + str(value))
+            lines.append(METRICPREFIX + name + "_seconds_sum " + repr(total))
+            lines.append(METRICPREFIX + name + "_seconds_count " + str(count))
+        for name, (function, label) in self.gauges.items():
+            lines.append("# TYPE " + METRICPREFIX + name + " gauge")
+            for key, value in function().items():
+                lines.append(METRICPREFIX + name + "{" + label + "=\"" + key + "\"} " + str(value))
+        return "\n".join(lines) + "\n"
+
+#########################################################
+
+#########################################################
+# Class : metricsPublisher                              #
+#########################################################
+class metricsPublisher(threading.Thread):
+    # periodic retained JSON snapshot on MQTT
+    def __init__(self, metrics, publish, interval):
+        threading.Thread.__init__(self, name = "metricsPublisher", daemon = True)
+        self.metrics   = metrics
+        self.publish   = publish
+        self.interval  = max(1.0, interval)
+        self.stopEvent = threading.Event()
+
+    def run(self):
+        while not self.stopEvent.wait(self.interval):
+            try:
+                self.publish(json.dumps(self.metrics.snapshot()))
+            except Exception as e:
+                log.warning("Metrics publish failed: %s", e)
+
+    def stop(self):
+        self.stopEvent.set()
+
+#########################################################
+
+#########################################################
+# Class : latencyTracer                                 #
+#########################################################
+class latencyTracer(object):
+    # last events' spans in seconds, RX from ReadMessage to on_publish, TX from onmessage to WriteMessage done
+    def __init__(self, size, slo, debug = False):
+        self.lock    = threading.Lock()
+        self.rx      = deque(maxlen = size) # (read-lookup, lookup-publish, publish-ack, total)
+        self.tx      = deque(maxlen = size) # (queued, send, total)
+        self.pending = OrderedDict() # mid --> (name, read, lookup, publish)
+        self.acked   = OrderedDict() # mid --> ack time, when on_publish beats publish() returning
+        self.slo     = slo
+        self.slow    = 0
+        self.debug   = debug
+
+    def published(self, mid, name, read, lookup, publish):
+        with self.lock:
+            ack = self.acked.pop(mid, None)
+            if ack == None:
+                self.pending[mid] = (name, read, lookup, publish)
+                if len(self.pending) > TRACEPENDING:
+                    # never acknowledged, e.g. published while disconnected
+                    self.pending.popitem(last = False)
+                return
+        self.rxDone(name, read, lookup, publish, ack)
+
+    def ack(self, mid):
+        ack = time.monotonic()
+        with self.lock:
+            event = self.pending.pop(mid, None)
+            if event == None:
+                # not traced or not registered yet
+                self.acked[mid] = ack
+                if len(self.acked) > TRACEPENDING:
+                    self.acked.popitem(last = False)
+                return
+        self.rxDone(*event, ack)
+
+    def rxDone(self, name, read, lookup, publish, ack):
+        spans = (lookup - read, publish - lookup, ack - publish, ack - read)
+        with self.lock:
+            self.rx.append(spans)
+        self.check("event", name, spans, "read-lookup", "lookup-publish", "publish-ack")
+
+    def txDone(self, name, received, start, end):
+        spans = (start - received, end - start, end - received)
+        with self.lock:
+            self.tx.append(spans)
+        self.check("command", name, spans, "queued", "send")
+
+    def check(self, kind, name, spans, *names):
+        if self.slo > 0 and spans[-1] > self.slo:
+            self.slow += 1
+            log.warning("Trace: slow %s [%s] %s ms (%s)", kind, name, self.ms(spans[-1]),
+                        ", ".join(span + " " + self.ms(value) for span, value in zip(names, spans)))
+        elif self.debug:
+            log.debug("Trace: %s [%s] %s ms", kind, name, self.ms(spans[-1]))
+
+    def percentiles(self):
+        with self.lock:
+            rx = list(self.rx)
+            tx = list(self.tx)
+        report = OrderedDict()
+        for kind, spans, names in (("rx", rx, TRACERXSPANS), ("tx", tx, TRACETXSPANS)):
+            report[kind] = OrderedDict()
+            for index, name in enumerate(names):
+                values = sorted(span[index] for span in spans)
+                if not values:
+                    continue
+                report[kind][name] = OrderedDict([("count", len(values))] +
+                    [(label, round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 3)) for label, p in TRACEPERCENTILES] +
+                    [("max", round(values[-1] * 1000, 3))])
+        report["slow"] = self.slow
+        return report
+
+    def printReport(self):
+        report = self.percentiles()
+        log.info("Trace: latency in ms, slow events: %s", report["slow"])
+        for kind in ("rx", "tx"):
+            for name, values in report[kind].items():
+                log.info("  %s %-14s %s", kind, name, ", ".join(label + " " + str(value) for label, value in values.items()))
+
+    def ms(self, seconds):
+        return str(round(seconds * 1000, 3))
+
+#########################################################
+
+#########################################################
+# Class : traceReporter                                 #
+#########################################################
+class traceReporter(threading.Thread):
+    # prints percentiles on request (SIGUSR1), optionally publishes them periodically
+    def __init__(self, tracer, publish, interval):
+        threading.Thread.__init__(self, name = "traceReporter", daemon = True)
+        self.tracer    = tracer
+        self.publish   = publish
+        self.interval  = max(1.0, interval)
+        self.wakeEvent = threading.Event()
+        self.requested = False
+        self.stopped   = False
+
+    def run(self):
+        due = time.monotonic() + self.interval
+        while True:
+            self.wakeEvent.wait(max(0.0, due - time.monotonic()) if self.publish else None)
+            self.wakeEvent.clear()
+            if self.stopped:
+                break
+            if self.requested:
+                self.requested = False
+                self.tracer.printReport()
+            if self.publish and time.monotonic() >= due:
+                due += self.interval
+                try:
+                    self.publish(json.dumps(self.tracer.percentiles()))
+                except Exception as e:
+                    log.warning("Trace publish failed: %s", e)
+
+    def request(self):
+        # safe to call from a signal handler
+        self.requested = True
+        self.wakeEvent.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeEvent.set()
+
+#########################################################
+
+#########################################################
+# Class : spillFile                                     #
+#########################################################
+class spillFile(object):
+    # ring of outbox messages in a memory-mapped file, kept over restarts
+    # header: OUTBOXMAGIC, head, tail, used bytes, count; records: length, seq, qos, retain, topic length, topic, payload
+    def __init__(self, path, size = OUTBOXFILESIZE):
+        import mmap
+        size = max(size, SPILLHEADER.size + 4096)
+        self.file = open(path, "a+b")
+        if os.fstat(self.file.fileno()).st_size != size:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.capacity = size - SPILLHEADER.size
+        magic, self.head, self.tail, self.used, self.count = SPILLHEADER.unpack_from(self.map, 0)
+        if magic != OUTBOXMAGIC or max(self.head, self.tail, self.used) > self.capacity:
+            self.head = self.tail = self.used = self.count = 0
+            self.sync()
+
+    def __len__(self):
+        return self.count
+
+    def put(self, entry):
+        # returns the number of oldest messages dropped to make room
+        topic = entry[0].encode(ENCODING)
+        body = SPILLRECORD.pack(entry[4], entry[2], entry[3], len(topic)) + topic + entry[1]
+        need = 4 + len(body)
+        if need > self.capacity:
+            return 1
+        dropped = 0
+        while self.count and self.capacity - self.used < need + self.gap(need):
+            self.drop()
+            dropped += 1
+        if self.capacity - self.tail < need:
+            # no room left at the end, continue at the start
+            gap = self.capacity - self.tail
+            if gap >= 4:
+                struct.pack_into("<I", self.map, SPILLHEADER.size + self.tail, 0)
+            self.used += gap
+            self.tail = 0
+        offset = SPILLHEADER.size + self.tail
+        struct.pack_into("<I", self.map, offset, len(body))
+        self.map[offset + 4:offset + need] = body
+        self.tail += need
+        self.used += need
+        self.count += 1
+        self.sync()
+        return dropped
+
+    def get(self):
+        length = self.skip()
+        offset = SPILLHEADER.size + self.head + 4
+        seq, qos, retain, size = SPILLRECORD.unpack_from(self.map, offset)
+        offset += SPILLRECORD.size
+        topic = bytes(self.map[offset:offset + size]).decode(ENCODING)
+        payload = bytes(self.map[offset + size:offset + length - SPILLRECORD.size])
+        self.release(length)
+        return [topic, payload, qos, retain, seq]
+
+    def drop(self):
+        self.release(self.skip())
+
+    def lastSeq(self):
+        # highest sequence number stored, to continue numbering after a restart
+        seq, head = 0, self.head
+        for index in range(self.count):
+            head, length = self.at(head)
+            seq = max(seq, SPILLRECORD.unpack_from(self.map, SPILLHEADER.size + head + 4)[0])
+            head += 4 + length
+        return seq
+
+    def at(self, head):
+        # position and length of the record at head, past an end of ring gap
+        if self.capacity - head < 4 or struct.unpack_from("<I", self.map, SPILLHEADER.size + head)[0] == 0:
+            head = 0
+        return head, struct.unpack_from("<I", self.map, SPILLHEADER.size + head)[0]
+
+    def skip(self):
+        head, length = self.at(self.head)
+        if head != self.head:
+            self.used -= self.capacity - self.head
+            self.head = head
+        return length
+
+    def release(self, length):
+        self.head += 4 + length
+        self.used -= 4 + length
+        self.count -= 1
+        if self.count == 0:
+            self.head = self.tail = self.used = 0
+        self.sync()
+
+    def gap(self, need):
+        return self.capacity - self.tail if self.capacity - self.tail < need else 0
+
+    def sync(self):
+        SPILLHEADER.pack_into(self.map, 0, OUTBOXMAGIC, self.head, self.tail, self.used, self.count)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+#########################################################
+
+#########################################################
+# Class : outbox                                        #
+#########################################################
+class outbox(object):
+    # ordered, bounded store of events and states while the broker cannot take them
+    # memory first; with a spill file, overflow goes there until it is drained
+    def __init__(self, size = OUTBOXSIZE, spill = None):
+        self.lock       = threading.Lock()
+        self.items      = deque() # [topic, payload, qos, retain, seq]
+        self.size       = max(1, size)
+        self.spill      = spill
+        self.entries    = {} # keep-latest topic --> its entry in memory
+        self.latest     = {} # keep-latest topic --> seq of its newest message
+        self.seq        = spill.lastSeq() if spill != None else 0
+        self.buffered   = 0
+        self.dropped    = 0
+        self.superseded = 0
+        self.flushed    = 0
+        self.closed     = False
+
+    def __len__(self):
+        return len(self.items) + (len(self.spill) if self.spill != None else 0)
+
+    def put(self, topic, payload, qos, retain, latest = False):
+        if isinstance(payload, str):
+            payload = payload.encode(ENCODING)
+        with self.lock:
+            if self.closed:
+                self.dropped += 1
+                return
+            self.buffered += 1
+            if latest:
+                entry = self.entries.get(topic)
+                if entry:
+                    # keep the position, replace the message
+                    entry[1] = payload
+                    entry[3] = retain
+                    self.superseded += 1
+                    return
+            self.seq += 1
+            entry = [topic, payload, qos, retain, self.seq]
+            if latest:
+                self.latest[topic] = self.seq
+            if self.spill != None and (len(self.spill) or len(self.items) >= self.size):
+                self.dropped += self.spill.put(entry)
+                return
+            if len(self.items) >= self.size:
+                self.forget(self.items.popleft())
+                self.dropped += 1
+            self.items.append(entry)
+            if latest:
+                self.entries[topic] = entry
+
+    def get(self):
+        # oldest message, None if empty
+        with self.lock:
+            if self.items:
+                entry = self.items.popleft()
+                self.forget(entry)
+                return entry
+            while self.spill != None and len(self.spill):
+                entry = self.spill.get()
+                if entry[4] < self.latest.get(entry[0], 0):
+                    self.superseded += 1
+                    continue
+                return entry
+            return None
+
+    def requeue(self, entry):
+        # publish failed, the message is the oldest again
+        with self.lock:
+            self.items.appendleft(entry)
+            if entry[0] in self.latest and not entry[0] in self.entries:
+                self.entries[entry[0]] = entry
+
+    def done(self):
+        with self.lock:
+            self.flushed += 1
+
+    def forget(self, entry):
+        if self.entries.get(entry[0]) is entry:
+            del self.entries[entry[0]]
+
+    def close(self):
+        # with a spill file the memory part is kept too, for the next run
+        with self.lock:
+            self.closed = True
+            if self.spill != None:
+                entries = list(self.items)
+                while len(self.spill):
+                    entries.append(self.spill.get())
+                for entry in entries:
+                    self.dropped += self.spill.put(entry)
+                self.items.clear()
+                self.entries.clear()
+                self.spill.close()
+
+#########################################################
+
+#########################################################
+# Class : outboxFlusher                                 #
+#########################################################
+class outboxFlusher(threading.Thread):
+    # replays the outbox in order and rate limited once the broker takes messages again
+    def __init__(self, outbox, publish, ready, rate = OUTBOXRATE):
+        threading.Thread.__init__(self, name = "outboxFlusher", daemon = True)
+        self.outbox    = outbox
+        self.publish   = publish
+        self.ready     = ready
+        self.interval  = 1.0 / rate if rate > 0 else 0
+        self.wakeEvent = threading.Event()
+        self.stopped   = False
+
+    def run(self):
+        while not self.stopped:
+            # retry now and then, congestion clears without a wake up
+            self.wakeEvent.wait(OUTBOXRETRY)
+            self.wakeEvent.clear()
+            while not self.stopped and self.ready():
+                entry = self.outbox.get()
+                if entry == None:
+                    break
+                if not self.publish(entry):
+                    self.outbox.requeue(entry)
+                    break
+                self.outbox.done()
+                if self.interval:
+                    time.sleep(self.interval)
+
+    def wake(self):
+        self.wakeEvent.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeEvent.set()
+
+#########################################################
+
+#########################################################
+# Class : codeLearner                                   #
+#########################################################
+class codeLearner(object):
+    # unknown 433MHz codes, least recently seen dropped first, each announced once
+    def __init__(self, publish, size = LEARNSIZE, rate = LEARNRATE, snippet = False, debug = False):
+        self.lock     = threading.Lock()
+        self.codes    = OrderedDict() # (syscode, groupcode, devicecode) --> code record
+        self.publish  = publish
+        self.size     = max(1, size)
+        self.rate     = rate / 60.0   # announcements per second
+        self.burst    = max(1.0, float(rate))
+        self.tokens   = self.burst
+        self.refilled = time.monotonic()
+        self.snippet  = snippet
+        self.debug    = debug
+        self.limited  = 0
+
+    def seen(self, syscode, groupcode, devicecode, value, radio):
+        key = (syscode, groupcode, devicecode)
+        now = time.time()
+        with self.lock:
+            code = self.codes.get(key)
+            if code:
+                self.codes.move_to_end(key)
+                code["last_seen"] = now
+                code["count"] += 1
+                code["value"] = value
+            else:
+                code = {"first_seen": now, "last_seen": now, "count": 1, "value": value, "radio": radio, "announced": False}
+                self.codes[key] = code
+                if len(self.codes) > self.size:
+                    self.codes.popitem(last = False)
+            if code["announced"]:
+                return
+            if not self.allow():
+                # announced on a later frame of this code
+                self.limited += 1
+                return
+            code["announced"] = True
+            payload = self.announcement(key, code)
+        self.publish(payload)
+        if self.debug:
+            log.debug("433MHz: learned code: SysCode: %s, GroupCode: %s, DeviceCode: %s", syscode, groupcode, devicecode)
+
+    def allow(self):
+        # token bucket, refilled at the announcement rate
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def announcement(self, key, code):
+        payload = OrderedDict([("syscode", key[0]), ("groupcode", key[1]), ("devicecode", key[2]), ("value", code["value"]),
+                               ("radio", code["radio"]), ("first_seen", self.timestamp(code["first_seen"])),
+                               ("last_seen", self.timestamp(code["last_seen"])), ("count", code["count"])])
+        if self.snippet:
+            payload["xml"] = self.xmlSnippet(key, code["radio"])
+        return json.dumps(payload)
+
+    def xmlSnippet(self, key, radio):
+        # input device for the <devices> section, ready to paste
+        name = "learned_" + "_".join(str(item) for item in key)
+        device = ET.Element(name)
+        ET.SubElement(device, "RFout").text = "false"
+        if radio != DEFAULTRADIO:
+            ET.SubElement(device, "radio").text = radio
+        item433 = ET.SubElement(device, "item433")
+        for tag, value in zip(("SysCode", "GroupCode", "DeviceCode"), key):
+            ET.SubElement(item433, tag).text = str(value)
+        hadevice = ET.SubElement(device, "hadevice")
+        ET.SubElement(hadevice, "name").text = name
+        itemmqtt = ET.SubElement(device, "itemmqtt")
+        ET.SubElement(itemmqtt, "maintopic").text = name
+        ET.SubElement(itemmqtt, "stat_t").text = "event"
+        ET.SubElement(device, "hatype").text = "event"
+        hadisco = ET.SubElement(device, "hadisco")
+        ET.SubElement(hadisco, "name").text = name
+        ET.SubElement(hadisco, "dev_cla").text = "button"
+        if hasattr(ET, "indent"):
+            ET.indent(device, "\t")
+        return ET.tostring(device, encoding = "unicode")
+
+    def prune(self, config):
+        # codes configured by a reload are no longer unknown
+        known = set(device.code.key for device in config.inputs.values())
+        with self.lock:
+            for key in [key for key in self.codes.keys() if key in known]:
+                del self.codes[key]
+
+    def timestamp(self, seconds):
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seconds))
+
+#########################################################
+
+#########################################################
+# Class : logQueueHandler                               #
+#########################################################
+class logQueueHandler(logging.Handler):
+    # hand the record over as is, the writer thread formats it
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+
+    def emit(self, record):
+        self.records.put_nowait(record)
+
+#########################################################
+
+#########################################################
+# Class : logRing                                       #
+#########################################################
+class logRing(logging.Handler):
+    # last records, unformatted until dumped
+    def __init__(self, size):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.records = deque(maxlen = size)
+        self.setFormatter(logging.Formatter(LOGRINGFORMAT))
+
+    def handle(self, record):
+        # no handler lock, appending to a deque is atomic
+        self.records.append(record)
+        return True
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def dump(self):
+        return [self.format(record) for record in self.records.copy()]
+
+#########################################################
+
+#########################################################
+# Class : logOutput                                     #
+#########################################################
+class logOutput(logging.StreamHandler):
+    # runs on the writer thread, a dump request is expanded into the ring's records here
+    def handle(self, record):
+        ring = getattr(record, "ring", None)
+        if ring == None:
+            return logging.StreamHandler.handle(self, record)
+        lines = ring.dump()
+        logging.StreamHandler.handle(self, self.record("Log ring: last " + str(len(lines)) + " records"))
+        for line in lines:
+            logging.StreamHandler.handle(self, self.record(line))
+        return True
+
+    @staticmethod
+    def record(message, ring = None):
+        return logging.makeLogRecord({"msg": message, "levelno": logging.INFO, "levelname": "INFO", "ring": ring})
+
+#########################################################
+
+#########################################################
+# Class : logWriter                                     #
+#########################################################
+class logWriter(object):
+    # callers only queue records, a background thread writes them
+    def __init__(self, stream = None):
+        from logging.handlers import QueueListener # socket and pickle, not needed before the daemon starts
+        self.queue    = queue.SimpleQueue() # reentrant, safe to put from signal handlers
+        self.handler  = logQueueHandler(self.queue)
+        self.handler.setLevel(logging.INFO)
+        output = logOutput(stream if stream else sys.stdout)
+        output.setFormatter(logging.Formatter(LOGFORMAT))
+        self.listener = QueueListener(self.queue, output)
+        self.ring     = None
+        log.addHandler(self.handler)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def setLevel(self, debug, ringsize = 0):
+        # debug records are only created when written or kept in the ring
+        self.handler.setLevel(logging.DEBUG if debug else logging.INFO)
+        if ringsize > 0 and self.ring == None:
+            self.ring = logRing(ringsize)
+            log.addHandler(self.ring)
+        log.setLevel(logging.DEBUG if debug or self.ring != None else logging.INFO)
+
+    def dump(self):
+        # only a request, safe from a signal handler, the writer thread formats the ring
+        self.queue.put(logOutput.record("", self.ring))
+
+    def write(self, message):
+        # straight to the writer, bypasses the ring
+        self.queue.put(logOutput.record(message))
+
+    def stop(self):
+        self.listener.stop()
+
+#########################################################
+
+#########################################################
+# Class : asyncCore                                     #
+#########################################################
+class asyncCore(object):
+    # single asyncio loop driving the paho socket, RX, TX, discovery and shutdown
+    def __init__(self, app):
+        self.app        = app
+        self.loop       = None
+        self.loopThread = None
+        self.stopEvent  = None
+        self.rxEvent    = None
+        self.executor   = None
+
+    def run(self):
+        import asyncio
+        self.asyncio = asyncio
+        asyncio.run(self.main())
+
+    async def main(self):
+        asyncio = self.asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        self.loop = asyncio.get_running_loop()
+        self.loopThread = threading.get_ident()
+        self.stopEvent = asyncio.Event()
+        self.rxEvent = asyncio.Event()
+        # one thread per radio owns it for TX, slow transmissions never block the loop
+        for link in self.app.radios.values():
+            link.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "txRadio_" + link.name)
+        self.loop.add_signal_handler(signal.SIGINT, self.stop)
+        self.loop.add_signal_handler(signal.SIGTERM, self.stop)
+        self.loop.add_signal_handler(signal.SIGHUP, self.app.reload_app, signal.SIGHUP, None)
+        self.loop.add_signal_handler(signal.SIGUSR1, self.app.trace_app, signal.SIGUSR1, None)
+        self.loop.add_signal_handler(signal.SIGUSR2, self.app.dumplog_app, signal.SIGUSR2, None)
+
+        brokers = list(self.app.brokers.values())
+        for broker in brokers:
+            broker.sockClosed = asyncio.Event()
+            client = broker.client
+            client.on_socket_open = self.onSocketOpen
+            client.on_socket_close = self.onSocketClose
+            client.on_socket_register_write = self.onSocketRegisterWrite
+            client.on_socket_unregister_write = self.onSocketUnregisterWrite
+        # every broker connects in the background, an offline broker doesn't hold up the others or RX
+        tasks = [self.loop.create_task(self.startBroker(broker)) for broker in brokers]
+        self.app.timer.mark("broker start")
+
+        self.app.startWatcher()
+        self.app.startMetrics()
+        for link in self.app.radios.values():
+            tasks.append(self.loop.create_task(self.rxTask(link)))
+        txTasks = [self.loop.create_task(self.txTask(link)) for link in self.app.radios.values()]
+        await self.stopEvent.wait()
+
+        ####### Shutdown
+        self.app.term = True
+        self.app.watcher.stop()
+        self.app.stopMetrics()
+        for link in self.app.radios.values():
+            link.commands.close()
+        for task in tasks:
+            task.cancel()
+        for broker in brokers:
+            if broker.discoTask:
+                broker.discoTask.cancel()
+        await asyncio.wait(txTasks, timeout = TXJOINTIME)
+        await asyncio.gather(*tasks, return_exceptions = True)
+        self.app.stopOutbox()
+        self.app.printStats()
+        # only the brokers with an open socket get to close it
+        closing = [broker.sockClosed.wait() for broker in brokers if broker.client.socket()]
+        for broker in brokers:
+            broker.client.disconnect() # disconnect
+        if closing:
+            try:
+                await asyncio.wait_for(asyncio.gather(*closing), TXJOINTIME)
+            except asyncio.TimeoutError:
                 pass
-        return inputs
-    
-    def get433Outputs(self):
-        outputs = {}
-        for key, device in self.db()["devices"].items():
+        self.shutdownExecutors()
+
+    async def connect(self, broker):
+        # retry until the broker is reachable or the daemon is stopped
+        delay = self.app.newBackoff()
+        while True:
+            wait = await self.loop.run_in_executor(None, self.app.connectOnce, broker, delay)
+            if wait == None:
+                return True
             try:
-                if device["RFout"]:
-                    output = {}
-                    if "cmd_t" in device["itemmqtt"].keys():
-                        output["cmd"] = self.joinTopic(device["itemmqtt"]["maintopic"],device["itemmqtt"]["cmd_t"])
-                    elif "command_topic" in device["itemmqtt"].keys():
-                        output["cmd"] = self.joinTopic(device["itemmqtt"]["maintopic"],device["itemmqtt"]["command_topic"])
-                    if "stat_t" in device["itemmqtt"].keys():
-                        output["stat"] = self.joinTopic(device["itemmqtt"]["maintopic"],device["itemmqtt"]["stat_t"])
-                    elif "status_topic" in device["itemmqtt"].keys():
-                        output["stat"] = self.joinTopic(device["itemmqtt"]["maintopic"],device["itemmqtt"]["status_topic"])
-                    if "SysCode" in device["item433"].keys():
-                        output["SysCode"] = device["item433"]["SysCode"]
-                    if "GroupCode" in device["item433"].keys():
-                        output["GroupCode"] = device["item433"]["GroupCode"]
-                    if "DeviceCode" in device["item433"].keys():
-                        output["DeviceCode"] = device["item433"]["DeviceCode"]
-                    outputs[key] = output
-            except:
+                await self.asyncio.wait_for(self.stopEvent.wait(), wait)
+                return False
+            except self.asyncio.TimeoutError:
                 pass
-        return outputs
 
-    def joinTopic(self, maintopic, topic):
-        return maintopic + "/" + topic
+    async def startBroker(self, broker):
+        if await self.connect(broker):
+            if broker.primary:
+                self.app.timer.event("broker connect")
+            self.scheduleDiscos(broker)
+            await self.miscTask(broker)
+
+    def shutdownExecutors(self):
+        for link in self.app.radios.values():
+            if link.executor:
+                link.executor.shutdown(wait = False)
+
+    def stop(self):
+        log.info("Terminating ...")
+        self.stopEvent.set()
+
+    def call(self, callback, *args):
+        # paho may call back from another thread (TX publish, reload), the loop is not thread safe
+        if threading.get_ident() == self.loopThread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def onSocketOpen(self, client, userdata, sock):
+        self.call(self.loop.add_reader, sock, client.loop_read)
+
+    def onSocketClose(self, client, userdata, sock):
+        # closed on the loop thread, unregister before the descriptor is gone
+        self.call(self.socketClosed, userdata, sock)
+
+    def socketClosed(self, broker, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        broker.sockClosed.set()
+
+    def onSocketRegisterWrite(self, client, userdata, sock):
+        self.call(self.addWriter, sock, client.loop_write)
+
+    def addWriter(self, sock, callback):
+        # a deferred request may arrive after the socket is closed
+        if sock.fileno() >= 0:
+            self.loop.add_writer(sock, callback)
+
+    def onSocketUnregisterWrite(self, client, userdata, sock):
+        self.call(self.loop.remove_writer, sock)
+
+    async def miscTask(self, broker):
+        # keepalives and reconnect, what loop_start() does in threaded mode
+        import paho.mqtt.client as mqttclient
+        delay = self.app.newBackoff()
+        while True:
+            if broker.client.loop_misc() == mqttclient.MQTT_ERR_NO_CONN:
+                try:
+                    broker.sockClosed.clear()
+                    await self.loop.run_in_executor(None, broker.client.reconnect)
+                    delay.reset()
+                except Exception as e:
+                    wait = delay.next()
+                    if self.app.debug:
+                        log.debug("MQTT: reconnect failed [%s]: %s, retry in %s s", broker.name, e, round(wait, 1))
+                    await self.asyncio.sleep(wait)
+                    continue
+            await self.asyncio.sleep(1)
+
+    def enableRx(self, enabled):
+        if enabled:
+            self.call(self.rxEvent.set)
+
+    async def rxTask(self, link):
+        reader = radioReader(link.radio, link.name, self.app.rxPoll())
+        while True:
+            if len(self.app.config.inputs) == 0:
+                # no input devices, wait for a reload to enable RX
+                self.rxEvent.clear()
+                await self.rxEvent.wait()
+                continue
+            # drain every pending frame, then wait for the radio
+            wait = reader.drain(self.app.handleFrame)
+            if reader.fd >= 0:
+                await self.readable(reader.fd)
+            else:
+                await self.asyncio.sleep(wait)
+
+    async def readable(self, fd):
+        ready = self.loop.create_future()
+        self.loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await self.asyncio.wait_for(ready, RXFDTIMEOUT)
+        except self.asyncio.TimeoutError:
+            pass
+        finally:
+            self.loop.remove_reader(fd)
+
+    async def txTask(self, link):
+        # one long-lived TX loop per radio on its own thread, the loop only waits for it at shutdown
+        await self.loop.run_in_executor(link.executor, txWorker.serve, link, self.app.transmit)
+
+    def scheduleDiscos(self, broker):
+        def start():
+            if not broker.discoTask or broker.discoTask.done():
+                broker.discoTask = self.loop.create_task(self.publishDiscos(broker))
+            elif self.app.debug:
+                log.debug("MQTT: HA Discovery already in progress [%s]", broker.name)
+        self.call(start)
+
+    async def publishDiscos(self, broker):
+        for wait in self.app.discoBatches(broker):
+            await self.asyncio.sleep(wait)
+
+#########################################################
+
+#########################################################
+# Class : mqtt433MHz                                    #
+#########################################################
+class mqtt433MHz(object):
+    def __init__(self):
+        self.name         = ""
+        self.brokers      = OrderedDict()
+        self.debug        = False
+        self.headers      = {}
+        self.values       = {}
+        self.config       = compiledConfig({}, "")
+        self.radios       = OrderedDict()
+        self.metrics      = metrics()
+        self.metricsPublisher = None
+        self.metricsServer = None
+        self.tracer       = None
+        self.traceReporter = None
+        self.dedupe       = None
+        self.watcher      = None
+        self.timer        = startupTimer()
+        self.startupReport = False
+        self.asyncMode    = False
+        self.core         = None
+        self.nodeId       = ""
+        self.capture      = None
+        self.learner      = None
+        self.outboxInflight = OUTBOXINFLIGHT
+        self.capturePath  = ""
+        self.replayPath   = ""
+        self.replaySpeed  = REPLAYSPEED
+        self.logWriter    = None
+        signal.signal(signal.SIGINT, self.exit_app)
+        signal.signal(signal.SIGTERM, self.exit_app)
+        signal.signal(signal.SIGHUP, self.reload_app)
+        signal.signal(signal.SIGUSR1, self.trace_app)
+        signal.signal(signal.SIGUSR2, self.dumplog_app)
+        self.term         = False
+        self.termEvent    = threading.Event()
+
+    def __del__(self):
+        pass
+
+    def __str__(self):
+        return "{}: 433 MHz to MQTT translator".format(self.name)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def run(self, argv):
+        if len(os.path.split(argv[0])) > 1:
+            self.name = os.path.split(argv[0])[1]
+        else:
+            self.name = argv[0]
+
+        self.timer.phases.append(("imports", IMPORTEND - IMPORTSTART))
+        self.timer.last = time.monotonic()
+        self.logWriter = logWriter()
+        self.db = database()
+        self.timer.mark("config parse")
+
+        args = []
+        options = iter(argv[1:])
+        for arg in options:
+            if arg[0] == "-":
+                if arg == "-h" or arg == "--help":
+                    self.printHelp()
+                    exit()
+                elif arg == "-v" or arg == "--version":
+                    print(self)
+                    print("Version: {}".format(VERSION))
+                    exit()
+                elif arg == "-d" or arg == "--debug":
+                    self.debug = True
+                elif arg == "-s" or arg == "--startup-report":
+                    self.startupReport = True
+                elif arg == "-a" or arg == "--asyncio":
+                    self.asyncMode = True
+                elif arg == "-c" or arg == "--capture":
+                    self.capturePath = self.optionValue(options, arg)
+                elif arg == "-r" or arg == "--replay":
+                    self.replayPath = self.optionValue(options, arg)
+                elif arg == "--speed":
+                    self.replaySpeed = self.parseSpeed(self.optionValue(options, arg))
+                else:
+                    self.parseError(arg)
+            else:
+                args.append(arg)
+        if len(args) < 1:
+            if not ifinstalled:
+                print(self)
+                print("MQTT not installed")
+                print("Please install paho mqtt: pip3 install paho-mqtt")
+                print("Terminating")
+                exit(1)
+            if not if433installed and not self.replayPath:
+                print(self)
+                print("Pi433MHzif not installed")
+                print("Please install Pi433MHzif: see https://github.com/helly1206/Pi433MHz")
+                print("Terminating")
+                exit(1)
+            self.daemon()
+        else:
+            self.parseError(args[0])
+
+    def printHelp(self):
+        print(self)
+        print("Usage:")
+        print("    {} {}".format(self.name, "<arguments>"))
+        print("        -h, --help    : Display this help")
+        print("        -v, --version : Display version")
+        print("        -d, --debug   : Debug communication")
+        print("        -s, --startup-report: Display time spent in each startup phase")
+        print("        -a, --asyncio : Run all I/O on a single asyncio event loop")
+        print("        -c, --capture <file>: Append every received frame to a capture file")
+        print("        -r, --replay <file>: Receive frames from a capture file instead of the radio")
+        print("        --speed <speed>: Replay speed, 1 is real time, e.g. 10 or max (default 1)")
+        print("        <no arguments>: run as daemon")
+        print("")
+
+    def optionValue(self, options, opt):
+        value = next(options, "")
+        if not value or value[0] == "-":
+            self.parseError(opt + " needs a value")
+        return value
+
+    def parseSpeed(self, value):
+        if value.lower() == "max":
+            return 0.0
+        try:
+            speed = float(value.lower().rstrip("x"))
+        except ValueError:
+            speed = -1
+        if speed < 0:
+            self.parseError("--speed " + value)
+        return speed
+
+    def parseError(self, opt = ""):
+        print(self)
+        print("Invalid option entered")
+        if opt:
+            print(opt)
+        print("Enter '{} -h' for help".format(self.name))
+        exit(1)
+
+    def daemon(self):
+        ####### Debug output and log ring, the ring keeps debug records too
+        ringsize = int(self.db.getSetting("logring", LOGRING))
+        if self.logWriter:
+            self.logWriter.setLevel(self.debug, ringsize)
+            self.debug = self.debug or self.logWriter.ring != None
+
+        ####### Compile devices and routing indexes
+        try:
+            self.compile()
+        except ValueError as e:
+            log.warning("Invalid configuration: %s, terminating", e)
+            exit(1)
+        self.timer.mark("config compile")
+
+        if self.capturePath:
+            try:
+                self.capture = frameCapture(self.capturePath)
+            except Exception as e:
+                log.warning("Capture file cannot be opened: %s", e)
+                exit(1)
+        for index, (name, args) in enumerate(self.config.radios.items()):
+            self.radios[name] = radioLink(name, self.openRadio(index, args), self.newTxQueue())
+        self.timer.mark("radio init")
+
+        ####### One client and outbox per broker
+        self.startBrokers()
+        if self.db.getSetting("trace", False):
+            self.tracer = latencyTracer(int(self.db.getSetting("tracesize", TRACESIZE)), float(self.db.getSetting("traceslo", 0)) / 1000, self.debug)
+        learntopic = self.db.getSetting("learntopic")
+        if learntopic:
+            self.learner = codeLearner(lambda payload: self.publish(learntopic, payload, False), int(self.db.getSetting("learnsize", LEARNSIZE)),
+                                       float(self.db.getSetting("learnrate", LEARNRATE)), bool(self.db.getSetting("learnsnippet", False)), self.debug)
+        self.timer.mark("mqtt init")
+
+        if self.asyncMode:
+            self.core = asyncCore(self)
+            self.core.run()
+        else:
+            self.runThreaded()
+
+    def runThreaded(self):
+        ####### Start transmitters, each the only one using its radio for TX
+        for link in self.radios.values():
+            link.txWorker = txWorker(link, self.transmit)
+            link.txWorker.start()
+
+        ####### Connect and write disco topics in the background, topics are subscribed on every connack
+        # an offline broker doesn't hold up the others or RX, events wait in its outbox
+        for broker in self.brokers.values():
+            threading.Thread(target = self.startBroker, args = (broker,), name = "brokerConnect_" + broker.name, daemon = True).start()
+        self.timer.mark("broker start")
+
+        ####### Reload on SIGHUP or file change
+        self.startWatcher()
+        self.startMetrics()
+
+        ####### Receive 433MHz frames
+        # without input devices the reader sleeps, and so does the main thread
+        # frames of all radios are merged into one queue
+        self.rxFrames = queue.Queue()
+        for link in self.radios.values():
+            link.rxWorker = rxWorker(link.radio, self.rxFrames, len(self.config.inputs)>0, link.name, self.termEvent, self.rxPoll())
+            link.rxWorker.start()
+        while not self.term:
+            # block until a reader hands over a frame, then drain all pending ones
+            frame = self.rxFrames.get()
+            while frame != None:
+                self.handleFrame(*frame)
+                try:
+                    frame = self.rxFrames.get_nowait()
+                except queue.Empty:
+                    frame = None
+        for link in self.radios.values():
+            link.rxWorker.join()
+        self.watcher.stop()
+        self.stopMetrics()
+
+        for link in self.radios.values():
+            link.commands.close()
+        for link in self.radios.values():
+            link.txWorker.join(TXJOINTIME)
+        self.stopOutbox()
+        self.printStats()
+
+        # disconnect all first, each loop_stop() waits for its network thread to notice
+        for broker in self.brokers.values():
+            broker.client.disconnect() # disconnect
+        for broker in self.brokers.values():
+            broker.client.loop_stop()    #Stop loop
+
+    def startBrokers(self):
+        self.outboxInflight = int(self.db.getSetting("outboxinflight", OUTBOXINFLIGHT))
+        mindelay = int(max(1, float(self.db.getSetting("reconnectdelay", RECONNECTDELAY))))
+        maxdelay = int(max(1, float(self.db.getSetting("reconnectmaxdelay", RECONNECTMAXDELAY))))
+        for index, (name, settings) in enumerate(self.config.brokers.items()):
+            if not "broker" in settings:
+                log.warning("No broker entered [%s], terminating", name)
+                exit(1)
+            try:
+                broker = brokerLink(name, settings, index == 0)
+            except (ValueError, TypeError) as e:
+                log.warning("Broker [%s] settings invalid: %s, terminating", name, e)
+                exit(1)
+            # the first broker keeps the client id, and with it a persistent session
+            broker.client = self.newClient("mqtt433MHz_" + self.getNodeId() + ("_" + name if index > 0 else ""), not broker.persistent)  #create new instance
+            broker.client.user_data_set(broker) # passed to every callback
+            broker.client.reconnect_delay_set(mindelay, maxdelay)
+            broker.client.on_message=self.onmessage #attach function to callback
+            broker.client.on_connect=self.onconnect  #bind call back function
+            broker.client.on_disconnect=self.ondisconnect  #bind call back function
+            broker.client.on_log=self.onlog
+            broker.client.on_publish=self.onpublish
+            if "username" in settings:
+                password = str(settings["password"]) if "password" in settings else None
+                broker.client.username_pw_set(str(settings["username"]), password=password)
+            self.startOutbox(broker)
+            self.brokers[name] = broker
+
+    def startBroker(self, broker):
+        if self.connectBroker(broker) and not self.term:
+            if broker.primary:
+                self.timer.event("broker connect")
+            broker.client.loop_start() #start the loop, reconnects with backoff
+            self.publishDiscos(broker)
+
+    def discosPublished(self, broker):
+        if broker.primary:
+            self.startupEvent("discovery publish")
+
+    def startupEvent(self, name):
+        # startup is complete when the first broker is subscribed and has its discovery topics
+        self.timer.event(name)
+        if self.startupReport and "subscribe" in self.timer.events and "discovery publish" in self.timer.events:
+            self.timer.reportOnce()
+
+    def connectBroker(self, broker):
+        # retry until the broker is reachable or the daemon is stopped
+        delay = self.newBackoff()
+        while not self.term:
+            wait = self.connectOnce(broker, delay)
+            if wait == None:
+                return True
+            self.termEvent.wait(wait)
+        return False
+
+    def connectOnce(self, broker, delay):
+        # one attempt, returns the seconds until the next one, None when connected
+        try:
+            broker.client.connect(broker.host, port=broker.port) #connect to broker
+            return None
+        except Exception as e:
+            wait = delay.next()
+            log.warning("Broker [%s] connection failed: %s, retry in %s s", broker.name, e, round(wait, 1))
+            return wait
+
+    def newBackoff(self):
+        return backoff(float(self.db.getSetting("reconnectdelay", RECONNECTDELAY)), float(self.db.getSetting("reconnectmaxdelay", RECONNECTMAXDELAY)))
+
+    def subscribeTopics(self, broker):
+        # one SUBSCRIBE for all topics, after every (re)connect
+        config = self.config
+        qos = broker.subQos()
+        topics = [(broker.topic(topic), qos) for topic in config.commands.keys()] + [(config.haStatusTopic, qos)]
+        broker.client.subscribe(topics)
+        if broker.primary:
+            self.startupEvent("subscribe")
+        if self.debug:
+            log.debug("MQTT: subscribed [%s] %s topics", broker.name, len(topics))
+
+    def startMetrics(self):
+        self.metrics.gauge("tx_queue_depth", lambda: dict((link.name, link.commands.depth()) for link in self.radios.values()))
+        self.metrics.gauge("mqtt_connected", lambda: dict((broker.name, int(broker.connected)) for broker in self.brokers.values()), "broker")
+        outboxes = [broker.outbox for broker in self.brokers.values() if broker.outbox != None]
+        if outboxes:
+            # all brokers together
+            self.metrics.gauge("outbox_messages", lambda: OrderedDict([("pending", sum(len(box) for box in outboxes)), ("buffered", sum(box.buffered for box in outboxes)),
+                ("dropped", sum(box.dropped for box in outboxes)), ("superseded", sum(box.superseded for box in outboxes)), ("flushed", sum(box.flushed for box in outboxes))]), "state")
+        topic = self.db.getSetting("metricstopic")
+        if topic:
+            publish = lambda payload: self.publish(topic, payload, RETAIN)
+            self.metricsPublisher = metricsPublisher(self.metrics, publish, float(self.db.getSetting("metricsinterval", METRICSINTERVAL)))
+            self.metricsPublisher.start()
+        port = self.db.getSetting("metricsport")
+        if port:
+            try:
+                self.metricsServer = self.newMetricsServer(self.db.getSetting("metricsaddress", METRICSADDRESS), int(port))
+            except Exception as e:
+                log.warning("Metrics port %s not available: %s", port, e)
+
+        if self.tracer:
+            traceTopic = self.db.getSetting("tracetopic")
+            tracePublish = None
+            if traceTopic:
+                tracePublish = lambda payload: self.publish(traceTopic, payload, RETAIN)
+            self.traceReporter = traceReporter(self.tracer, tracePublish, float(self.db.getSetting("traceinterval", TRACEINTERVAL)))
+            self.traceReporter.start()
+
+    def stopMetrics(self):
+        if self.metricsPublisher:
+            self.metricsPublisher.stop()
+        if self.metricsServer:
+            self.metricsServer.shutdown()
+        if self.traceReporter:
+            self.traceReporter.stop()
+
+    def newMetricsServer(self, address, port):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        registry = self.metrics
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode(ENCODING)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        server = ThreadingHTTPServer((address, port), handler)
+        server.daemon_threads = True
+        threading.Thread(target = server.serve_forever, name = "metricsServer", daemon = True).start()
+        return server
+
+    def startOutbox(self, broker):
+        size = int(self.db.getSetting("outboxsize", OUTBOXSIZE))
+        if size <= 0:
+            return
+        spill = None
+        path = broker.settings.get("outboxfile")
+        if path:
+            try:
+                spill = spillFile(str(path), int(self.db.getSetting("outboxfilesize", OUTBOXFILESIZE)))
+            except Exception as e:
+                log.warning("Outbox file cannot be opened: %s", e)
+        broker.outbox = outbox(size, spill)
+        if len(broker.outbox):
+            log.info("Outbox [%s]: %s messages from previous run", broker.name, len(broker.outbox))
+        broker.flusher = outboxFlusher(broker.outbox, lambda entry: self.publishEntry(broker, entry), lambda: self.brokerReady(broker),
+                                       float(self.db.getSetting("outboxrate", OUTBOXRATE)))
+        broker.flusher.start()
+
+    def stopOutbox(self):
+        for broker in self.brokers.values():
+            if broker.flusher:
+                broker.flusher.stop()
+                broker.flusher.join(TXJOINTIME)
+                broker.outbox.close()
+
+    def startWatcher(self):
+        self.watcher = configWatcher(self.db.getXMLpath(), float(self.db.getSetting("watchconfig", WATCHCONFIG)), self.reloadConfig)
+        self.watcher.start()
+
+    def printStats(self):
+        if self.learner and self.debug:
+            log.debug("433MHz: unknown codes: %s, announcements rate limited: %s", len(self.learner.codes), self.learner.limited)
+        for broker in self.brokers.values():
+            box = broker.outbox
+            if box != None and self.debug:
+                log.debug("MQTT: outbox [%s] pending: %s, buffered: %s, dropped: %s, superseded: %s, flushed: %s", broker.name, len(box), box.buffered, box.dropped, box.superseded, box.flushed)
+        if self.capture:
+            self.capture.close()
+            log.info("Capture closed, frames: %s", self.capture.frames)
+        if self.tracer:
+            self.tracer.printReport()
+        if self.debug:
+            log.debug("433MHz: RX duplicates dropped: %s %s", self.dedupe.suppressed, self.dedupe.counts)
+            for link in self.radios.values():
+                commands = link.commands
+                log.debug("433MHz: TX queue [%s] closed, pending: %s, max depth: %s, dropped: %s, rejected: %s, coalesced: %s", link.name, len(commands.items), commands.maxdepth, commands.dropped, commands.rejected, commands.coalesced)
+
+    def openRadio(self, index, args):
+        if self.replayPath:
+            try:
+                radio = replayRadio(self.replayPath, self.replaySpeed, index, self.debug)
+            except Exception as e:
+                log.warning("Replay file cannot be opened: %s", e)
+                exit(1)
+        else:
+            radio = self.newRadio(args)
+        if self.capture:
+            radio = captureRadio(radio, self.capture, index)
+        return radio
+
+    def newRadio(self, args = {}):
+        from Pi433MHzif import Pi433MHzif
+        return Pi433MHzif.Pi433MHzif(**args)
+
+    def newTxQueue(self):
+        return txQueue(self.db.getSetting("txqueuesize", TXQUEUESIZE), self.db.getSetting("txoverflow", TXOVERFLOW), self.db.getSetting("txcoalesce", TXCOALESCE))
+
+    def newClient(self, clientId, cleanSession = True):
+        import paho.mqtt.client as mqttclient
+        return mqttclient.Client(clientId, clean_session = cleanSession)
+
+    def handleFrame(self, array, radio = DEFAULTRADIO, received = None, frametime = None):
+        self.metrics.inc("rx_frames")
+        config = self.config
+        # known frames are a single lookup, only other values are decoded and encoded here
+        frame = tuple(array)
+        event = None
+        if config.multiRadio:
+            # a device bound to this radio goes before one receiving on all radios
+            event = config.frames.get((radio,) + frame)
+        if not event:
+            event = config.frames.get(frame)
+        if not event:
+            event = self.decodeFrame(array, radio, config)
+            if not event:
+                return
+        tracer = self.tracer if received != None else None
+        lookup = time.monotonic() if tracer else None
+        self.metrics.inc("rx_matched")
+        input = event.device
+        if input.dedupe > 0 and self.dedupe.suppress(event.key, input.dedupe, input.name, frametime):
+            self.metrics.inc("rx_duplicates")
+            if self.debug:
+                log.debug("433MHz: duplicate dropped: %s, value: %s", input.code, event.value)
+            return
+        stamps = [] if tracer else None
+        info = self.publishEvent(input.topics.stat, event.payload, RETAINEVENT, input.latest, stamps) # value doesn't matter I geuss, retain should be false 
+        if tracer and info and stamps:
+            tracer.published(info.mid, input.name, received, lookup, stamps[0])
+        self.metrics.inc("events_published")
+        if received != None:
+            self.metrics.observe("rx_latency", time.monotonic() - received)
+        if self.debug:
+            log.debug("433MHz: received [%s]: %s, value: %s", radio, input.code, event.value)
+            log.debug("MQTT: publish event: %s/%s", input.topics.stat, event.payload.decode(ENCODING))
+
+    def decodeFrame(self, array, radio, config):
+        syscode, groupcode, devicecode, val = self.array2code(array)
+        input = None
+        if config.multiRadio:
+            input = config.inputs.get((radio, syscode, groupcode, devicecode))
+        if not input:
+            input = config.inputs.get((syscode, groupcode, devicecode))
+        if not input:
+            self.metrics.inc("rx_unmatched")
+            if self.learner:
+                self.learner.seen(syscode, groupcode, devicecode, val, radio)
+            return None
+        return rfEvent(input, val, config.eventPayload(val), (syscode, groupcode, devicecode, val))
+
+    def rxPoll(self):
+        # longest wait between polls of a radio without a file descriptor
+        return max(0.001, float(self.db.getSetting("rxpoll", RXPOLLMAX)))
+
+    def exit_app(self, signum, frame):
+        log.info("Terminating ...")
+        self.term = True
+        self.termEvent.set()
+        # don't touch the frame queue from the handler, the readers wake the main loop
+        for link in self.radios.values():
+            if link.rxWorker:
+                link.rxWorker.stop()
+
+    def enableRx(self, enabled):
+        for link in self.radios.values():
+            if link.rxWorker:
+                link.rxWorker.enable(enabled)
+        if self.core:
+            self.core.enableRx(enabled)
+
+    def reload_app(self, signum, frame):
+        log.info("Reloading configuration ...")
+        if self.watcher:
+            self.watcher.trigger()
+
+    def trace_app(self, signum, frame):
+        if self.traceReporter:
+            self.traceReporter.request()
+        else:
+            log.info("Tracing not enabled, set <trace> in the configuration")
+
+    def dumplog_app(self, signum, frame):
+        if self.logWriter and self.logWriter.ring != None:
+            self.logWriter.dump()
+        else:
+            log.info("Log ring not enabled, set <logring> in the configuration")
+
+    def reloadConfig(self):
+        # runs on the watcher thread, RX and TX keep running on the current config until swapped
+        old = self.config
+        saved = self.db.snapshot()
+        if not self.db.reload():
+            log.warning("Reload failed, keeping current configuration")
+            return
+        # settings and compiled config are swapped together or not at all
+        try:
+            new = self.compileConfig()
+        except ValueError as e:
+            self.db.restore(saved)
+            log.warning("Reload failed: %s, keeping current configuration", e)
+            return
+        self.setConfig(new)
+        if new.brokers != old.brokers:
+            log.info("Broker settings changed, restart to apply")
+        if new.radios != old.radios:
+            log.info("Radio settings changed, restart to apply")
+        self.enableRx(len(new.inputs)>0)
+        if self.learner:
+            self.learner.prune(new)
+
+        removed = sorted(old.commands.keys() - new.commands.keys())
+        added = sorted(new.commands.keys() - old.commands.keys())
+        for broker in self.brokers.values():
+            ####### Update subscriptions
+            unsubscribe = [broker.topic(topic) for topic in removed]
+            subscribe = [broker.topic(topic) for topic in added]
+            if old.haStatusTopic != new.haStatusTopic:
+                unsubscribe.append(old.haStatusTopic)
+                subscribe.append(new.haStatusTopic)
+            if unsubscribe:
+                broker.client.unsubscribe(unsubscribe)
+            if subscribe:
+                broker.client.subscribe([(topic, broker.subQos()) for topic in subscribe])
+            if self.debug:
+                for topic in unsubscribe:
+                    log.debug("MQTT: unsubscribed [%s]: %s", broker.name, topic)
+                for topic in subscribe:
+                    log.debug("MQTT: subscribed [%s]: %s", broker.name, topic)
+
+            ####### Update disco topics
+            olddiscos = broker.discos(old)
+            newdiscos = broker.discos(new)
+            for topic in olddiscos.keys() - newdiscos.keys():
+                # empty retained payload removes the entity
+                self.publishTo(broker, topic, b"", RETAIN)
+                if self.debug:
+                    log.debug("MQTT: HA Discovery removed [%s]", topic)
+            for topic, payload in newdiscos.items():
+                if olddiscos.get(topic) != payload:
+                    self.publishDisco(broker, topic, payload)
+        log.info("Configuration reloaded, devices: %s", len(new.devices))
+
+    def onlog(self, client, userdata, level, buf):
+        if self.debug:
+            log.debug("%s", buf)
+
+    def onmessage(self, client, userdata, message):
+        # userdata is the broker, commands of every broker go to the same TX queues
+        received = time.monotonic() if self.tracer else None
+        if self.config.haStatusTopic == message.topic:
+            if message.payload.decode('utf-8') == HAONLINE:
+                if self.debug:
+                    log.debug("MQTT: received HA online [%s], issue HA Discovery", userdata.name)
+                ####### Replay disco topics to this broker, paced outside the paho thread
+                if self.core:
+                    self.core.scheduleDiscos(userdata)
+                else:
+                    threading.Thread(target = self.publishDiscos, args = (userdata,), name = "discoPublisher", daemon = True).start()
+                return
+
+        output = self.config.commands.get(userdata.localTopic(message.topic))
+        if output:
+            self.metrics.inc("commands_received")
+            command = output.commands.get(message.payload)
+            if not command:
+                command = rfCommand(message.payload.decode('utf-8'), message.payload, None)
+            # only enqueue here, the TX worker of the device's radio does the (slow) transmission
+            link = self.radios.get(output.radio)
+            if not link:
+                # radio added by a reload, only available after restart
+                link = next(iter(self.radios.values()))
+            # in asyncio mode this is the event loop, which must never wait for the TX thread
+            if not link.commands.put((output, command, received), output.code.key, self.core == None):
+                self.metrics.inc("commands_rejected")
+                log.warning("433MHz: TX queue [%s] full, command rejected: %s/%s", link.name, output.topics.cmd, command.value)
+            elif self.debug:
+                log.debug("MQTT: received cmd: %s/%s, TX queue [%s] depth: %s", output.topics.cmd, command.value, link.name, link.commands.depth())
+
+    def publishDiscos(self, broker = None):
+        # publish discovery payloads in batches, one replay per broker at a time, all brokers if None
+        for broker in [broker] if broker else list(self.brokers.values()):
+            if not broker.discoLock.acquire(blocking = False):
+                if self.debug:
+                    log.debug("MQTT: HA Discovery already in progress [%s]", broker.name)
+                continue
+            try:
+                for wait in self.discoBatches(broker):
+                    if self.term:
+                        break
+                    time.sleep(wait)
+            finally:
+                broker.discoLock.release()
+
+    def discoBatches(self, broker):
+        # publishes a batch per step and yields the seconds to wait before the next one, shared by both run modes
+        batch = max(1, int(self.db.getSetting("discobatch", DISCOBATCH)))
+        delay = float(self.db.getSetting("discodelay", DISCODELAY))
+        discos = list(broker.discos(self.config).items())
+        for start in range(0, len(discos), batch):
+            if start > 0 and delay > 0:
+                yield delay
+            for topic, payload in discos[start:start + batch]:
+                self.publishDisco(broker, topic, payload)
+        self.discosPublished(broker)
+
+    def publishDisco(self, broker, topic, payload):
+        self.publishTo(broker, topic, payload, RETAIN)
+        if self.debug:
+            log.debug("MQTT: HA Discovery [%s]: %s", topic, payload.decode(ENCODING))
+
+    def publish(self, topic, payload, retain):
+        # to every broker, returns the first broker's message info
+        info = None
+        for broker in self.brokers.values():
+            brokerInfo = self.publishTo(broker, broker.topic(topic), payload, retain)
+            if broker.primary:
+                info = brokerInfo
+        return info
+
+    def publishTo(self, broker, topic, payload, retain, stamps = None):
+        if stamps != None and broker.primary:
+            # traced, the time the message is handed to paho
+            stamps.append(time.monotonic())
+        info = broker.client.publish(topic, payload, broker.qos, retain)
+        if info.rc == 0:
+            broker.sent += 1
+        return info
+
+    def publishEvent(self, topic, payload, retain, latest = False, stamps = None):
+        # to every broker, each through its own outbox, returns the first broker's message info (None if queued)
+        info = None
+        for broker in self.brokers.values():
+            brokerInfo = self.publishEventTo(broker, broker.topic(topic), payload, retain, latest, stamps)
+            if broker.primary:
+                info = brokerInfo
+        return info
+
+    def publishEventTo(self, broker, topic, payload, retain, latest, stamps = None):
+        # through the outbox while the broker cannot take it, and until the outbox is drained to keep the order
+        box = broker.outbox
+        if box != None and (not broker.connected or len(box) or self.congested(broker)):
+            box.put(topic, payload, broker.qos, retain, latest)
+            if broker.connected:
+                broker.flusher.wake()
+            if self.debug:
+                log.debug("MQTT: outbox [%s] %s: %s", broker.name, len(box), topic)
+            return None
+        info = self.publishTo(broker, topic, payload, retain, stamps)
+        if info.rc != 0 and box != None:
+            box.put(topic, payload, broker.qos, retain, latest)
+        return info
+
+    def publishEntry(self, broker, entry):
+        return self.publishTo(broker, entry[0], entry[1], entry[3]).rc == 0
+
+    def brokerReady(self, broker):
+        return broker.connected and not self.congested(broker)
+
+    def congested(self, broker):
+        # approximate, messages handed to paho but not written to the broker yet
+        return self.outboxInflight > 0 and broker.sent - broker.acked > self.outboxInflight
+
+    def transmit(self, link, output, command, received = None):
+        start = time.monotonic()
+        try:
+            if command.frame:
+                link.radio.WriteMessage(command.frame, len(command.frame))
+            else:
+                self.send433MHz(output.code.syscode, output.code.groupcode, output.code.devicecode, command.value, link.radio)
+        except:
+            self.metrics.inc("tx_errors")
+            raise
+        end = time.monotonic()
+        self.metrics.observe("tx_duration", end - start)
+        self.metrics.inc("tx")
+        if self.tracer and received != None:
+            self.tracer.txDone(output.name, received, start, end)
+        if output.topics.stat:
+            # as current state is unknown, just copy value to stat
+            self.publishEvent(output.topics.stat, command.payload, RETAIN, output.latest)
+        if self.debug:
+            log.debug("433MHz: send [%s]: %s", link.name, output.code)
+            if output.topics.stat:
+                log.debug("MQTT: publish stat: %s/%s", output.topics.stat, command.value)
+
+    def onconnect(self, client, userdata, flags, rc):
+        broker = userdata
+        if rc == 0:
+            if broker.primary:
+                self.timer.event("broker connack")
+            self.metrics.inc("mqtt_connects")
+            log.info("Connected OK [%s], Returned code = %s", broker.name, rc)
+            self.subscribeTopics(broker)
+            # paho drops what was not written before the reconnect
+            broker.sent = broker.acked = 0
+            broker.connected = True
+            if broker.outbox != None and len(broker.outbox):
+                log.info("Outbox [%s]: flushing %s messages", broker.name, len(broker.outbox))
+                broker.flusher.wake()
+            broker.rcDisconnect = 0
+        else:
+            if broker.rcConnect != rc:
+                log.warning("Bad connection [%s], Returned code = %s", broker.name, rc)
+            broker.connected = False
+        broker.rcConnect = rc
+
+    def onpublish(self, client, userdata, mid):
+        userdata.acked += 1
+        if self.tracer and userdata.primary:
+            self.tracer.ack(mid)
+
+    def ondisconnect(self, client, userdata, rc):
+        broker = userdata
+        self.metrics.inc("mqtt_disconnects")
+        if rc == 0 or broker.rcDisconnect != rc:
+            log.info("Disconnected [%s], Returned code = %s", broker.name, rc)
+            broker.rcConnect = 0
+        broker.connected = False
+        broker.rcDisconnect = rc
+
+    def compile(self):
+        self.setConfig(self.compileConfig())
+
+    def compileConfig(self):
+        # Recompile only on config change, raises ValueError on invalid settings
+        return compiledConfig(self.db(), self.getNodeId(), self.config.version + 1, self.db.skipped)
+
+    def setConfig(self, config):
+        # the compiled config is replaced, never mutated
+        self.config = config
+        if not self.dedupe:
+            self.dedupe = dedupeFilter(self.config.dedupe)
+        else:
+            self.dedupe.maxwindow = self.config.dedupe
+
+    def getNodeId(self):
+        if not self.nodeId:
+            from uuid import getnode
+            self.nodeId = format(getnode(),'X')[-6:]
+        return self.nodeId
 
-    def send433MHz(self, syscode, groupcode, devicecode, value):
+    def send433MHz(self, syscode, groupcode, devicecode, value, radio):
         array = self.code2array(syscode, groupcode, devicecode, value)
-        return self.client433.WriteMessage(array, len(array)) 
+        return radio.WriteMessage(array, len(array)) 
 
     def code2array(self, syscode, groupcode, devicecode, value):
         array = []